@@ -2,7 +2,12 @@
 Set Constants
 """
 
-ALLOWED_SOURCES = ["jhu", "worldometer", "imedd", "govgr", "who", "sch"]
+from datetime import datetime
+
+ALLOWED_SOURCES = ["jhu", "jhu_us", "jhu_daily", "worldometer", "imedd", "govgr", "who", "sch"]
+# heavy sources left out of "all", they run only with an explicit --source
+OPT_IN_SOURCES = ["jhu_us", "jhu_daily"]
+ALLOWED_SINKS = ["mongo", "parquet", "sqlite"]
 COLUMN_MAPPINGS = {
     "Country,Other": "country",
     "TotalCases": "cases",
@@ -44,6 +49,57 @@ COLUMN_MAPPINGS = {
     "Long": "long",
     "Population": "population",
     "UID": "uid",
+    "Province_State": "state",
+    "FIPS": "fips",
+}
+# daily report headers changed over time, every variant maps to one column
+DAILY_REPORT_MAPPINGS = dict(
+    COLUMN_MAPPINGS,
+    **{
+        "Province/State": "state",
+        "Last Update": "last_update",
+        "Last_Update": "last_update",
+        "Latitude": "lat",
+        "Longitude": "long",
+        "Incidence_Rate": "incidence_rate",
+        "Incident_Rate": "incidence_rate",
+        "Case-Fatality_Ratio": "case_fatality_ratio",
+        "Case_Fatality_Ratio": "case_fatality_ratio",
+        "Combined_Key": "combined_key",
+        "People_Tested": "tests",
+        "Total_Test_Results": "tests",
+        "Testing_Rate": "testing_rate",
+    }
+)
+DAILY_REPORT_COUNTS = ["cases", "deaths", "recovered", "active", "tests"]
+# names the early daily reports used for countries JHU renamed later
+DAILY_REPORT_COUNTRY_ALIASES = {
+    "Mainland China": "China",
+    "Hong Kong SAR": "Hong Kong",
+    "Macao SAR": "Macau",
+    "Taipei and environs": "Taiwan*",
+    "South Korea": "Korea, South",
+    "Republic of Korea": "Korea, South",
+    "UK": "United Kingdom",
+    "North Ireland": "United Kingdom",
+    "Republic of Ireland": "Ireland",
+    "Iran (Islamic Republic of)": "Iran",
+    "Czech Republic": "Czechia",
+    "Viet Nam": "Vietnam",
+    "Russian Federation": "Russia",
+    "Republic of Moldova": "Moldova",
+    "Bahamas, The": "Bahamas",
+    "The Bahamas": "Bahamas",
+    "Gambia, The": "Gambia",
+    "The Gambia": "Gambia",
+    "Republic of the Congo": "Congo (Brazzaville)",
+    "occupied Palestinian territory": "West Bank and Gaza",
+    "Palestine": "West Bank and Gaza",
+    "Vatican City": "Holy See",
+    "Ivory Coast": "Cote d'Ivoire",
+    "Cape Verde": "Cabo Verde",
+    "East Timor": "Timor-Leste",
+    "St. Martin": "Saint Martin",
 }
 EXCLUDE_ROWS = [
     "",
@@ -61,16 +117,166 @@ EXCLUDE_ROWS = [
     "Greece"
 ]
 
+# long frame columns stored as categoricals, coordinates are repeated per
+# location and need more precision than float32 holds
+CATEGORICAL_COLUMNS = [
+    "country",
+    "iso2",
+    "iso3",
+    "uid",
+    "region",
+    "state",
+    "geo_unit",
+    "source",
+    "lat",
+    "long",
+]
+
+# greeceTimeline.csv status rows
+TIMELINE_COLUMNS = {
+    "cases": "new_cases",
+    "deaths": "new_deaths",
+    "hospitalized": "new_hospitalized",
+    "total cases": "cases",
+    "intubated": "critical",
+    "estimated_new_total_tests": "new_tests",
+    "cumulative_rtpcr_tests_raw": "tests_rtpcr",
+    "estimated_new_rtpcr_tests": "new_tests_rtpcr",
+    "cumulative_rapid_tests_raw": "tests_rapid",
+    "esitmated_new_rapid_tests": "new_tests_rapid",
+    "icu_discharges": "icu_discharges",
+    "hospital_admissions": "new_hospital_admissions",
+    "hospital_discharges": "new_hospital_discharges",
+    "intubated_unvac": "intubated_unvac",
+    "intubated_vac": "intubated_vac",
+    "icu_occupancy": "icu_occupancy",
+    "beds_occupancy": "beds_occupancy",
+}
+TIMELINE_PAD = [
+    "critical",
+    "recovered",
+    "icu_discharges",
+    "intubated_unvac",
+    "intubated_vac",
+]
+TIMELINE_CUMULATIVE = {
+    "new_deaths": "deaths",
+    "new_tests": "tests",
+    "new_hospital_admissions": "hospital_admissions",
+    "new_hospital_discharges": "hospital_discharges",
+}
+TIMELINE_DTYPES = {
+    "population": "int",
+    "cases": "int",
+    "deaths": "int",
+    "recovered": "int",
+    "active": "int",
+    "new_cases": "int",
+    "new_deaths": "int",
+    "new_recovered": "int",
+    "new_hospitalized": "int",
+    "intensive_care": "int",
+    "critical": "int",
+    "tests_rtpcr": "int",
+    "new_tests_rtpcr": "int",
+    "tests_rapid": "int",
+    "new_tests_rapid": "int",
+    "tests": "int",
+    "new_tests": "int",
+    "icu_discharges": "int",
+    "hospital_admissions": "int",
+    "hospital_discharges": "int",
+    "new_hospital_admissions": "int",
+    "new_hospital_discharges": "int",
+    "intubated_unvac": "int",
+    "intubated_vac": "int",
+    "icu_occupancy": "float",
+    "beds_occupancy": "float",
+}
+
 OUTPUT = "data/"
 TMP = "tmp/"
 
+FINGERPRINTS_COLLECTION = "fingerprints"
+# sources sharing the global collection, a row per country and date among them,
+# a country listed in the precedence keeps the rows of its first source with the date
+GLOBAL_SOURCES = ["jhu", "imedd"]
+GLOBAL_KEYS = ["date", "uid", "country", "iso3"]
+SOURCE_PRECEDENCE = {"GRC": ["imedd", "jhu"]}
+
+# windows of the derived metrics in days, growth compares the last window with the one before
+METRICS_AVERAGE_DAYS = 7
+METRICS_INCIDENCE_DAYS = 14
+METRICS_GROWTH_DAYS = 7
+
+REVISIONS_COLLECTION = "revisions"
+# columns stamped on every run, not revisions of the upstream values
+REVISIONS_IGNORE_COLUMNS = ["last_updated_at"]
+
+# rough size of one document field once built as a python dict
+MEMORY_DOC_FIELD_BYTES = 120
+MEMORY_MIN_CHUNK = 1000
+
+# documents per write and built batches waiting for the writer thread
+MIGRATE_BATCH_SIZE = 5000
+MIGRATE_QUEUE_DEPTH = 2
+
+# columns stamped on every run, a change in them alone is not archived
+ARCHIVE_IGNORE_COLUMNS = ["last_updated_at"]
+ARCHIVE_COMPRESSION = "zstd"
+
+REFERENCE_COUNTRIES_PATH = "./data/countries-mapping-jhu-wom.csv"
+REFERENCE_REGIONS_PATH = "./data/region-mapping-imedd.csv"
+
 DATA_JHU_BASE_PATH = "jhu/csse_covid_19_data/csse_covid_19_time_series/"
+# uids, fips and iso codes of every JHU location, states and territories included
+DATA_JHU_UID_LOOKUP_PATH = "jhu/csse_covid_19_data/UID_ISO_FIPS_LookUp_Table.csv"
+DATA_JHU_DAILY_PATH = "jhu/csse_covid_19_data/csse_covid_19_daily_reports/"
 DATA_IMEDD_BASE_PATH = "imedd/COVID-19/"
 DATA_WOM_BASE_LINK = "https://www.worldometers.info/coronavirus/"
 DATA_SCH_BASE_LINK = "https://www.sch.gr/anastoli/web/index.php"
+SCH_PAGE_SIZE = 100
+SCH_WORKERS = 8
+# ended closures are kept for a week after their due date
+SCH_CLOSURE_TTL = 7 * 24 * 60 * 60
 REPO_JHU_URL = "https://github.com/CSSEGISandData/COVID-19.git"
 REPO_IMEDD_URL = "https://github.com/iMEdD-Lab/open-data.git"
 
+# http client, rate limits are requests per second per host
+HTTP_TIMEOUT = 30
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5
+HTTP_RETRY_STATUSES = [429, 500, 502, 503, 504]
+HTTP_POOL_SIZE = 10
+HTTP_RATE_LIMITS = {
+    "data.gov.gr": 5,
+    "www.sch.gr": 10,
+    "www.worldometers.info": 1,
+}
+
+# first vaccination day and the days refetched before the newest stored one,
+# data.gov.gr revises recent days
+GOVGR_START_DATE = datetime(2020, 12, 27)
+GOVGR_REVISION_DAYS = 3
+
+# rows per chunk when splitting the US time series per state
+JHU_US_CHUNK_ROWS = 500
+JHU_US_ID_COLUMNS = [
+    "UID",
+    "iso2",
+    "iso3",
+    "code3",
+    "FIPS",
+    "Admin2",
+    "Province_State",
+    "Country_Region",
+    "Lat",
+    "Long_",
+    "Combined_Key",
+    "Population",
+]
+JHU_US_EXCLUDE_STATES = ["Diamond Princess", "Grand Princess"]
+
 FIX_CORDS = {
     "Canada": {"Lat": 56.1304, "Long": -106.3468},
     "China": {"Lat": 35.8617, "Long": 104.1954},
@@ -7,17 +7,20 @@ Import Libraries
 import sys
 import logging
 import argparse
+import gc
 import time
-import pymongo
 
-from pymongo import MongoClient
+from conf.constants import (
+    ALLOWED_SOURCES,
+    OPT_IN_SOURCES,
+    ALLOWED_SINKS,
+    SCH_CLOSURE_TTL,
+    REVISIONS_COLLECTION,
+)
 
-from conf.constants import ALLOWED_SOURCES
-
-from strategies.jhu import JHUStrategy
-from strategies.wom import WOMStrategy
-from strategies.imedd import IMEDDStrategy
-from strategies.govgr import GovGRStrategy
+from strategies import load_strategy
+from utils.fingerprint import save_fingerprint
+from utils.memory import MemoryBudget
 
 """
 Logging
@@ -64,43 +67,35 @@ def clean_docs(df):
 def getStrategy(source, *options):
     logging.debug("Choosing source strategy {}".format(source.upper()))
 
-    # switch case dictionary
-    switch = {
-        "jhu": JHUStrategy,
-        "worldometer": None,
-        "imedd": IMEDDStrategy,
-        "govgr": GovGRStrategy,
-        "who": None,
-        "eody": None,
-        "sch": None,
-    }
-
-    # get case
-    strategy = switch.get(source, lambda: "Invalid source")
-
-    if strategy == None:
-        logging.warning("Sorry, {} strategy not implemented yet or inactive".format(source.upper()))
-        return None
-
     try:  # try to extract data
+        # the strategy module is imported only now
+        strategy = load_strategy(source)
+        if strategy == None:
+            logging.warning("Sorry, {} strategy not implemented yet or inactive".format(source.upper()))
+            return None
+
         s = strategy(source, options)
+        # skip the transforms and go straight to migration
+        if options[0].get("from_cache"):
+            return s.from_cache()
         return s.get()
     except Warning as w:  # warn and pass on warning
         logging.warning(str(w))
         return None
-    except Exception as s:  # warn and pass on warning
-        logging.error(str(s))
-        return None
 
 
 def get_mongodb_client(uri):
     if not uri:
         logging.warning("MongoDB URI is missing, can't connect")
         return None
+    from pymongo import MongoClient
+
     return MongoClient(uri)
 
 
 def create_indexes(client, db, collection):
+    import pymongo
+
     coll = client.get_database(db).get_collection(collection)
     coll.create_index("date")
     coll.create_index("uid")
@@ -128,6 +123,120 @@ def create_indexes(client, db, collection):
         coll.create_index([("state", pymongo.ASCENDING), ("date", pymongo.ASCENDING)], sparse=True)
         coll.create_index([("area", pymongo.ASCENDING), ("date", pymongo.ASCENDING)], sparse=True)
 
+    elif collection == "provinces":
+        coll.create_index("iso3")
+        coll.create_index("state")
+        coll.create_index([("iso3", pymongo.ASCENDING), ("date", pymongo.ASCENDING)], sparse=True)
+        coll.create_index([("country", pymongo.ASCENDING), ("state", pymongo.ASCENDING), ("date", pymongo.ASCENDING)], sparse=True)
+
+    elif collection == "us":
+        coll.create_index("state")
+        coll.create_index("fips")
+        coll.create_index([("geo_unit", pymongo.ASCENDING), ("date", pymongo.ASCENDING)], sparse=True)
+        coll.create_index([("state", pymongo.ASCENDING), ("date", pymongo.ASCENDING)], sparse=True)
+        coll.create_index([("fips", pymongo.ASCENDING), ("date", pymongo.ASCENDING)], sparse=True)
+
+    elif collection == "gr_school_closures":
+        coll.create_index("region")
+        coll.create_index([("school", pymongo.ASCENDING), ("region", pymongo.ASCENDING), ("dueTo", pymongo.ASCENDING)], unique=True)
+        # closures are removed by mongodb a while after they end
+        coll.create_index("dueTo", expireAfterSeconds=SCH_CLOSURE_TTL)
+
+    elif collection == REVISIONS_COLLECTION:
+        coll.create_index([("collection", pymongo.ASCENDING), ("source", pymongo.ASCENDING), ("uid", pymongo.ASCENDING), ("date", pymongo.ASCENDING), ("field", pymongo.ASCENDING), ("run", pymongo.ASCENDING)])
+        coll.create_index("run")
+
+
+def create_all_indexes(client, db):
+    create_indexes(client, db, "global")
+    create_indexes(client, db, "greece")
+    create_indexes(client, db, "gr_vaccines")
+    create_indexes(client, db, "us")
+    create_indexes(client, db, "provinces")
+    create_indexes(client, db, "gr_school_closures")
+    create_indexes(client, db, REVISIONS_COLLECTION)
+
+
+def run_source(args, source, migrated):
+    budget = args.memory
+    # one source at a time, its frames are released before the next one is read
+    with budget.stage("{} get".format(source.upper())):
+        strategy = getStrategy(source, vars(args))
+    if strategy is None:
+        return
+
+    # save data on mongodb
+    if not strategy.unchanged:
+        with budget.stage("{} migrate".format(source.upper())):
+            strategy.migrate()
+        migrated.add(strategy.name)
+        # remember the inputs only once they are stored
+        save_fingerprint(vars(args), strategy.name, strategy.fingerprint)
+
+    strategy.release()
+
+
+def run(args, sources):
+    budget = args.memory
+    # JHU runs last, it writes the global collection merged with the iMEdD timeline
+    sources = sorted(sources, key=lambda source: source == "jhu")
+    migrated = set()
+    failed = {}
+    for source in sources:
+        # a failed source is recorded, the others still run
+        try:
+            run_source(args, source, migrated)
+        except Exception as e:
+            logging.error("{} failed, {}".format(source.upper(), e))
+            failed[source] = str(e)
+        gc.collect()
+
+    # JHU failed or was unchanged, the new iMEdD timeline is written on its own
+    if "imedd" in migrated and "jhu" not in migrated:
+        try:
+            with budget.stage("IMEDD global"):
+                load_strategy("imedd")("imedd", [vars(args)]).enrich_global()
+        except Exception as e:
+            logging.error("IMEDD global failed, {}".format(e))
+            failed["imedd"] = str(e)
+
+    if "utils.requests" in sys.modules:
+        from utils.requests import get_client
+
+        # the totals of this run, the client outlives it in daemon mode
+        for host, stats in get_client(vars(args)).summary(reset=True).items():
+            logging.info("[HTTP] {} {}".format(host, stats))
+
+    # the daemon scheduler counts a run that raised as failed
+    if len(failed) > 0:
+        raise Exception(
+            "Sources failed: {}".format(
+                ", ".join("{} ({})".format(source, e) for source, e in failed.items())
+            )
+        )
+
+
+def daemon(args):
+    from utils.scheduler import Scheduler, parse_schedule
+
+    schedule = parse_schedule(args.schedule)
+    for source in schedule:
+        if source not in ALLOWED_SOURCES:
+            raise Exception('Sorry, source "{}" not allowed'.format(source))
+
+    # state kept warm between runs: the mongodb connection pool,
+    # the indexes and the cloned repositories which are pulled instead of cloned
+    args.keep_git = True
+    if "mongo" in args.sinks:
+        create_all_indexes(args.mongo_client, args.db)
+
+    scheduler = Scheduler(
+        schedule, lambda source: run(args, [source]), jitter=args.jitter
+    )
+    if args.status_port:
+        scheduler.serve_status(args.status_port)
+    scheduler.run_forever()
+
 
 """
 Initialize Covid-19 Automation Script
@@ -155,7 +264,7 @@ def cli():
     parser.add_argument(
         "--source",
         dest="source",
-        help="Set source (all|jhu|govgr|imedd)",
+        help="Set source (all|jhu|jhu_us|jhu_daily|govgr|imedd), all leaves out jhu_us and jhu_daily",
         default="all",
     )
     parser.add_argument(
@@ -186,6 +295,13 @@ def cli():
         default="covid19",
     )
     
+    parser.add_argument(
+        "--sink",
+        dest="sinks",
+        help="Output sink, repeat to write to several (mongo|parquet[:path]|sqlite[:path])",
+        action="append",
+    )
+    
     parser.add_argument(
         "--govgr_token",
         dest="govgr_token",
@@ -193,6 +309,78 @@ def cli():
         default="",
     )
 
+    parser.add_argument(
+        "--force",
+        dest="force",
+        help="Process sources even if upstream is unchanged",
+        type=bool,
+        default=False,
+    )
+
+    parser.add_argument(
+        "--from-cache",
+        dest="from_cache",
+        help="Migrate the last cached artifacts instead of processing sources",
+        type=bool,
+        default=False,
+    )
+
+    parser.add_argument(
+        "--daemon",
+        dest="daemon",
+        help="Keep running and refresh sources on a schedule",
+        type=bool,
+        default=False,
+    )
+    parser.add_argument(
+        "--schedule",
+        dest="schedule",
+        help="Daemon refresh interval per source in seconds (source=seconds,...)",
+        default="govgr=3600,imedd=7200,jhu=86400",
+    )
+    parser.add_argument(
+        "--jitter",
+        dest="jitter",
+        help="Daemon random delay added to each interval in seconds",
+        type=int,
+        default=300,
+    )
+    parser.add_argument(
+        "--status-port",
+        dest="status_port",
+        help="Daemon status endpoint port on localhost, 0 to disable",
+        type=int,
+        default=8080,
+    )
+    parser.add_argument(
+        "--archive",
+        dest="archive",
+        help="Append the rows changed since the last run to the history archive in the output path",
+        type=bool,
+        default=False,
+    )
+    parser.add_argument(
+        "--revisions",
+        dest="revisions",
+        help="Record the values changed upstream since the last run in the revisions collection",
+        type=bool,
+        default=False,
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        help="Worker processes for the partitioned sources, 0 for one per CPU",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--memory-budget",
+        dest="memory_budget",
+        help="Memory budget in MB, documents are built in chunks above it, 0 to only track",
+        type=int,
+        default=0,
+    )
+
     # parse cli arguments
     args = parser.parse_args()
     
@@ -200,36 +388,45 @@ def cli():
     logging.basicConfig(
         level=args.loglevel.upper(), format=log_format, datefmt="%Y-%m-%d %T%z"
     )
-    # create the mongodb client
-    mongo_client = get_mongodb_client("{}{}?retryWrites=true&w=majority".format(args.mongo, args.db))
-    args.mongo_client = mongo_client
-    
     # check if source strategy exists or is default
     if args.source not in ALLOWED_SOURCES and not args.source == "all":
         raise Exception('Sorry, source "{}" not allowed'.format(args.source))
+
+    args.sinks = args.sinks or ["mongo"]
+    for sink in args.sinks:
+        if sink.partition(":")[0] not in ALLOWED_SINKS:
+            raise Exception('Sorry, sink "{}" not allowed'.format(sink))
+
+    # create the mongodb client
+    mongo_client = get_mongodb_client("{}{}?retryWrites=true&w=majority".format(args.mongo, args.db))
+    args.mongo_client = mongo_client
+    args.memory = MemoryBudget(args.memory_budget)
     
-    sources = ALLOWED_SOURCES if args.source == "all" else [args.source]
-    strategies = []
-    for source in sources:
-        strategy = getStrategy(source, vars(args))
-        strategies.append(strategy)
-    logging.debug(
-        "All strategies completed in {}s".format(
-            round(time.time() - start, 2),
-        )
+    sources = (
+        [source for source in ALLOWED_SOURCES if source not in OPT_IN_SOURCES]
+        if args.source == "all"
+        else [args.source]
     )
-    # save data on mongodb
-    for strategy in strategies:
-        if strategy is not None:
-            strategy.migrate()
-            if strategy.name == "imedd":
-                strategy.enrich_global()
-    
-    # create mongodb indexes 
-    if args.drop:
-        create_indexes(mongo_client, args.db, "global")
-        create_indexes(mongo_client, args.db, "greece")
-        create_indexes(mongo_client, args.db, "gr_vaccines")
+
+    if args.daemon:
+        daemon(args)
+        return
+
+    try:
+        run(args, sources)
+    finally:
+        logging.debug(
+            "All strategies completed in {}s".format(
+                round(time.time() - start, 2),
+            )
+        )
+
+        # create mongodb indexes, the school closures expire through theirs
+        if "mongo" in args.sinks:
+            if args.drop:
+                create_all_indexes(mongo_client, args.db)
+            elif "sch" in sources:
+                create_indexes(mongo_client, args.db, "gr_school_closures")
 
 
 if __name__ == "__main__":
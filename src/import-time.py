@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""
+Import Libraries
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+from conf.constants import ALLOWED_SOURCES
+
+"""
+Measure startup import cost per source with `python -X importtime`
+"""
+
+
+def import_time(code):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stderr=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    total = 0
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        total += int(self_us)
+        # top level imports are not indented
+        if not name[1:].startswith(" "):
+            modules.append((int(cumulative_us), name.strip()))
+    return total, sorted(modules, reverse=True)
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--top",
+        dest="top",
+        help="Number of heaviest top level imports to list",
+        type=int,
+        default=5,
+    )
+    args = parser.parse_args()
+
+    # module level of the cli script, without running it
+    cases = [("cli", "import runpy; runpy.run_path('covid-19.py', run_name='bench')")]
+    cases += [
+        (
+            source,
+            "from strategies import load_strategy; load_strategy('{}')".format(source),
+        )
+        for source in ALLOWED_SOURCES
+    ]
+    for name, code in cases:
+        total, modules = import_time(code)
+        print(
+            "{:<12} {:>8.1f}ms {}".format(
+                name,
+                total / 1000,
+                ", ".join(
+                    "{} {:.1f}ms".format(m, us / 1000) for us, m in modules[: args.top]
+                ),
+            )
+        )
+
+
+if __name__ == "__main__":
+    cli()
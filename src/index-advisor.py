@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""
+Import Libraries
+"""
+
+import sys
+import logging
+import argparse
+
+from pymongo import MongoClient
+
+from utils.indexes import analyze, report, resolve_params
+
+"""
+Logging
+"""
+
+log_format = "%(asctime)s - [COVID19-AUTOMATION] [%(levelname)s] %(message)s"
+
+"""
+Run the dashboard query catalogue through explain() and suggest indexes
+"""
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--log-level", dest="loglevel", help="Set logging level", default="INFO"
+    )
+    parser.add_argument(
+        "--mongo",
+        dest="mongo",
+        help="MongoDB client URI",
+        default="mongodb://localhost:27017/",
+    )
+    parser.add_argument(
+        "--db",
+        dest="db",
+        help="Database name",
+        default="covid19",
+    )
+    parser.add_argument(
+        "--iso3",
+        dest="iso3",
+        help="Country used for the per-country series queries",
+        default="GRC",
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=args.loglevel.upper(), format=log_format, datefmt="%Y-%m-%d %T%z"
+    )
+
+    db = MongoClient(args.mongo).get_database(args.db)
+    results, suggestions = analyze(db, params=resolve_params(db, iso3=args.iso3))
+    report(results, suggestions)
+
+
+if __name__ == "__main__":
+    try:
+        cli()
+    except Exception as e:  # hold on exception
+        logging.error(str(e))
+    # exit on CTRL-D
+    except KeyboardInterrupt:
+        sys.exit("Exiting Index Advisor")
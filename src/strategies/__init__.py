@@ -0,0 +1,34 @@
+import importlib
+
+"""
+Strategy registry, each source module is imported only when the source runs
+"""
+
+STRATEGIES = {}
+
+
+def register(source, path=None):
+    STRATEGIES[source] = path
+
+
+def load_strategy(source):
+    if source not in STRATEGIES:
+        raise Exception('Sorry, source "{}" not allowed'.format(source))
+
+    path = STRATEGIES.get(source)
+    if path is None:
+        return None
+
+    module, name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module), name)
+
+
+register("jhu", "strategies.jhu.JHUStrategy")
+register("jhu_us", "strategies.jhu_us.JHUUSStrategy")
+register("jhu_daily", "strategies.jhu_daily.JHUDailyStrategy")
+register("worldometer")
+register("imedd", "strategies.imedd.IMEDDStrategy")
+register("govgr", "strategies.govgr.GovGRStrategy")
+register("who")
+register("eody")
+register("sch", "strategies.sch.SCHStrategy")
@@ -1,8 +1,7 @@
+import hashlib
 import logging
 import time
 import shutil
-import requests
-from requests.exceptions import HTTPError
 
 import pandas as pd
 import numpy as np
@@ -10,13 +9,44 @@ import numpy as np
 from dateutil.relativedelta import relativedelta
 
 from datetime import datetime, timedelta
-from pymongo import ReplaceOne
+
+from utils.artifacts import save_artifact, load_artifact
+from utils.sinks import get_sinks
+from utils.archive import archive_frames
+
+from utils.fingerprint import file_digest, is_unchanged
+from utils.reference import load_reference
+from utils.metrics import rolling_metrics, WINDOW_DAYS
+from utils.requests import get_client
 
 from conf.constants import (
     FIX_CORDS,
     COLUMN_MAPPINGS,
+    REFERENCE_REGIONS_PATH,
+    GOVGR_START_DATE,
+    GOVGR_REVISION_DAYS,
 )
 
+TOTALS = [
+    "total_distinct_persons",
+    "total_vaccinations",
+    "total_dose_1",
+    "total_dose_2",
+    "total_dose_3",
+]
+NEW_TOTALS = ["new_" + c for c in TOTALS]
+COUNTS = TOTALS[:2] + ["day_total", "day_diff"] + TOTALS[2:] + [
+    "daily_dose_1",
+    "daily_dose_2",
+    "daily_dose_3",
+]
+REGION_COLUMNS = ["geo_unit", "state", "region", "population", "lat", "long"]
+# daily columns with rolling metrics
+METRICS = ["new_total_vaccinations", "new_total_distinct_persons"]
+
+# a row per key, the upserts and the archive match rows on it
+KEYS = ["date", "uid", "region", "source"]
+
 
 class GovGRStrategy(object):
     """
@@ -29,16 +59,42 @@ class GovGRStrategy(object):
         self.dataframe = None
         self.collection = "gr_vaccines"
         self.docs = []
+        self.fingerprint = None
+        self.unchanged = False
+        self.incremental = False
 
     def save_dataframe(self):
-        self.dataframe.to_csv(
-            "{}{}-{}.csv".format(
+        save_artifact(
+            self.dataframe,
+            self.config.get("output"),
+            self.name,
+            __file__,
+            self.fingerprint,
+        )
+        if self.config.get("archive"):
+            # an incremental frame holds only the refetched days
+            archive_frames(
+                [self.dataframe],
                 self.config.get("output"),
-                datetime.now().strftime("%Y-%m-%d"),
                 self.name,
-            ),
-            index=False,
+                KEYS,
+                partial=self.incremental,
+            )
+
+    def from_cache(self):
+        self.dataframe, self.fingerprint = load_artifact(
+            self.config.get("output"), self.name, __file__
         )
+        if self.dataframe is None:
+            raise Warning("[GOVGR] No cached artifact for {}".format(self.name))
+        return self
+
+    def release(self):
+        """
+        Drop the frame and documents once they are stored
+        """
+        self.dataframe = None
+        self.docs = []
 
     def as_docs(self, dataframe):
         docs = []
@@ -55,57 +111,42 @@ class GovGRStrategy(object):
         return doc
 
     def migrate(self):
-        start = time.time()
-        self.docs = self.as_docs(self.dataframe)
-        coll = (
-            self.config.get("mongo_client")
-            .get_database(self.config.get("db"))
-            .get_collection(self.collection)
-        )
-        if self.config.get("drop"):
-            logging.debug("[GOVGR] Migrate Documents {}".format(len(self.docs)))
-            deleted = coll.delete_many({"source": "govgr"})
-            logging.debug(
-                "[GOVGR] Migration Drop Docs, {} deleted from {} in {}s".format(
-                    deleted.deleted_count,
-                    self.collection,
-                    round(time.time() - start, 2),
+        for sink in get_sinks(self.config, self.name):
+            start = time.time()
+            if self.config.get("drop"):
+                logging.debug("[GOVGR] Migrate Documents {} to {}".format(len(self.dataframe), sink))
+                deleted, inserted = sink.replace(
+                    self.collection, [self.dataframe], self.as_docs, {"source": "govgr"}, keys=KEYS
                 )
-            )
-            result = coll.insert_many(self.docs)
-            logging.debug(
-                "[GOVGR] Migration Completed, {} inserted in {} in {}s".format(
-                    len(result.inserted_ids),
-                    self.collection,
-                    round(time.time() - start, 2),
+                logging.debug(
+                    "[GOVGR] Migration Completed, {} deleted, {} inserted in {} on {} in {}s".format(
+                        deleted,
+                        inserted,
+                        self.collection,
+                        sink,
+                        round(time.time() - start, 2),
+                    )
                 )
-            )
-        else:
-            dates = [pd.to_datetime(datetime.today().strftime("%Y-%m-%d")) - timedelta(days=d) for d in range(5)]
-            reqs = [
-                ReplaceOne(
-                    {
-                        "date": doc["date"],
-                        "uid": doc["uid"],
-                        "region": doc["region"],
-                        "source": doc["source"],
-                    },
-                    doc,
-                    upsert=True,
-                )
-                for doc in self.docs
-                if doc["date"] in dates
-            ]
-            logging.debug("[GOVGR] Migrate Documents {}".format(len(reqs)))
-            result = coll.bulk_write(reqs)
-            logging.debug(
-                "[GOVGR] Migration Completed, {} inserted, {} modified in {} in {}s".format(
-                    result.inserted_count,
-                    result.modified_count,
+            else:
+                dates = [pd.to_datetime(datetime.today().strftime("%Y-%m-%d")) - timedelta(days=d) for d in range(5)]
+                # an incremental frame holds only the refetched days
+                frame = self.dataframe if self.incremental else self.dataframe[self.dataframe["date"].isin(dates)]
+                logging.debug("[GOVGR] Migrate Documents {} to {}".format(len(frame), sink))
+                inserted, modified = sink.upsert(
                     self.collection,
-                    round(time.time() - start, 2),
+                    [frame],
+                    self.as_docs,
+                    KEYS,
+                )
+                logging.debug(
+                    "[GOVGR] Migration Completed, {} inserted, {} modified in {} on {} in {}s".format(
+                        inserted,
+                        modified,
+                        self.collection,
+                        sink,
+                        round(time.time() - start, 2),
+                    )
                 )
-            )
     
     
     def get_url(self, url):
@@ -113,44 +154,106 @@ class GovGRStrategy(object):
             "Authorization": "Token {}".format(self.config.get("govgr_token"))
         }
         logging.debug("[GOVGR] Fetching Data from {}".format(url))
-        try:
-            response = requests.get(url, headers = headers)
-            response.raise_for_status()
-        except HTTPError:
-            raise
-        except Exception:
-            raise
-        
+        # past months revalidate against the cache instead of downloading again
+        response = get_client(self.config).get(url, headers = headers)
+
+        self.digest.update(response.content)
         return response.json()
                 
-    def get_recursive(self):
+    def get_recursive(self, date_start=GOVGR_START_DATE):
         data = []
-        date_start = datetime(2020, 12, 27)
         date_end = datetime.now()
-        num_months = (date_end.year - date_start.year) * 12 + (date_end.month - date_start.month)
-        
+
+        # one request per month, past months keep the same url and revalidate
         f = date_start
-        t = f + relativedelta(months = 1)
-        for m in range(num_months):
-            if m == num_months - 1:
-                t = date_end
-            url = "https://data.gov.gr/api/v1/query/mdg_emvolio?date_from={}&date_to={}&{}".format(f.strftime("%Y-%m-%d"), t.strftime("%Y-%m-%d"), time.time())
+        while f <= date_end:
+            t = min(f + relativedelta(months = 1, days = -1), date_end)
+            url = "https://data.gov.gr/api/v1/query/mdg_emvolio?date_from={}&date_to={}".format(f.strftime("%Y-%m-%d"), t.strftime("%Y-%m-%d"))
             data.extend(self.get_url(url))
-            # pagination
-            f = date_start + relativedelta(months = m + 1, days = 1)
-            t = f + relativedelta(months = 1, days = -1)      
-        
+            f = t + timedelta(days = 1)
+
         return data
 
+    def get_baseline(self):
+        """
+        Start of the incremental window and the stored totals of the day before it,
+        None when the whole history has to be fetched
+        """
+        client = self.config.get("mongo_client")
+        # the stored history is looked up in mongodb, other sinks get the whole history
+        if client is None or self.config.get("drop") or "mongo" not in (self.config.get("sinks") or ["mongo"]):
+            return None, None
+        coll = client.get_database(self.config.get("db")).get_collection(self.collection)
+        latest = coll.find_one({"source": "govgr"}, sort=[("date", -1)])
+        if latest is None:
+            return None, None
+
+        date_from = latest["date"] - timedelta(days = GOVGR_REVISION_DAYS)
+        previous = coll.find_one(
+            {"source": "govgr", "date": {"$lt": date_from}}, sort=[("date", -1)]
+        )
+        if previous is None:
+            return None, None
+        baseline = pd.DataFrame(
+            list(
+                coll.find(
+                    {"source": "govgr", "date": previous["date"]},
+                    {"_id": 0, "date": 1, "uid": 1, **{c: 1 for c in TOTALS}},
+                )
+            )
+        )
+        return date_from, baseline
+
+    def get_history(self, date_from):
+        """
+        The stored daily values the rolling windows of the refetched days read
+        """
+        coll = (
+            self.config.get("mongo_client")
+            .get_database(self.config.get("db"))
+            .get_collection(self.collection)
+        )
+        # a day more than the windows, so a full window is told from a short history
+        history = pd.DataFrame(
+            list(
+                coll.find(
+                    {
+                        "source": "govgr",
+                        "date": {
+                            "$gte": date_from - timedelta(days = WINDOW_DAYS),
+                            "$lt": date_from,
+                        },
+                    },
+                    {"_id": 0, "date": 1, "uid": 1, "population": 1, **{c: 1 for c in METRICS}},
+                )
+            ),
+            columns=["date", "uid", "population"] + METRICS,
+        )
+        history["date"] = pd.to_datetime(history["date"])
+        return history
+
     def get(self):
         logging.debug("[GOVGR] Getting Data")
        
-        fips = pd.read_csv("./data/region-mapping-imedd.csv")
-        fips = fips[fips["areaid"].notna()]
-        fips = fips.rename(columns=COLUMN_MAPPINGS).to_dict("records")
+        fips = load_reference(self.config.get("tmp")).area_lookup()
 
-        response = self.get_recursive()
+        self.digest = hashlib.sha256()
+        date_from, baseline = self.get_baseline()
+        self.incremental = date_from is not None
+        if self.incremental:
+            logging.debug("[GOVGR] Incremental from {}".format(date_from.strftime("%Y-%m-%d")))
+            response = self.get_recursive(date_from)
+        else:
+            response = self.get_recursive()
         logging.debug("[GOVGR] Data Loaded")
+
+        self.fingerprint = file_digest(
+            [REFERENCE_REGIONS_PATH, __file__], self.digest
+        )
+        if is_unchanged(self.config, self.name, self.fingerprint):
+            logging.info("[GOVGR] Upstream unchanged, skipping")
+            self.unchanged = True
+            return self
         
         df = pd.DataFrame.from_dict(response, orient = "columns")
         df = df.rename(columns = {
@@ -167,132 +270,71 @@ class GovGRStrategy(object):
         })
         
         df["date"] = pd.to_datetime(df["referencedate"])
-        df = df.sort_values(by="date").reset_index(drop = True)
         df = df.drop(columns=["referencedate"])
-        
-        first_day = df[df["date"] == pd.to_datetime(datetime.strptime("2020-12-28", "%Y-%m-%d"))]
-        first_day = first_day.reset_index(drop = True)
-        first_day.loc[:,"date"] = pd.to_datetime(datetime.strptime("2020-12-27", "%Y-%m-%d"))
-        
-        first_day["temp"] = first_day["total_distinct_persons"] - first_day["day_total"]
-        
-        first_day.loc[:,"total_distinct_persons"] = first_day["temp"]
-        first_day.loc[:,"total_vaccinations"] = first_day["temp"]
-        first_day.loc[:,"day_total"] = first_day["temp"]
-        first_day.loc[:,"day_diff"] = first_day["temp"]
-        
-        first_day.loc[:,"total_dose_1"] = first_day["temp"]
-        first_day.loc[:,"total_dose_2"] = np.nan
-        first_day.loc[:,"total_dose_3"] = np.nan
-        
-        first_day.loc[:,"daily_dose_1"] = first_day["temp"]
-        first_day.loc[:,"daily_dose_2"] = np.nan
-        first_day.loc[:,"daily_dose_3"] = np.nan
-        
-        first_day = first_day.drop(columns=["temp"])
-        
-        df = df.append(first_day).reset_index(drop = True)
-        
-        df["uid"] = df["areaid"].apply(lambda x: "PE{}".format(x))
-            
-        group = (
-            df.groupby(
-                ["date", "area", "areaid", "uid"]
-            )[[
-                "total_distinct_persons", "total_vaccinations", "day_total", "day_diff",
-                "total_dose_1", "total_dose_2", "total_dose_3", 
-                "daily_dose_1", "daily_dose_2", "daily_dose_3"
-                ]]
+
+        # the first published day also counts everyone vaccinated before it,
+        # they are moved to a synthetic day ahead of it
+        first_day = df[df["date"] == GOVGR_START_DATE + timedelta(days = 1)].copy()
+        before = first_day["total_distinct_persons"] - first_day["day_total"]
+        first_day["date"] = GOVGR_START_DATE
+        for column in ["total_distinct_persons", "total_vaccinations", "day_total", "day_diff", "total_dose_1", "daily_dose_1"]:
+            first_day[column] = before
+        first_day[["total_dose_2", "total_dose_3", "daily_dose_2", "daily_dose_3"]] = np.nan
+        df = pd.concat([df, first_day], ignore_index = True)
+
+        df["uid"] = "PE" + df["areaid"].astype(str)
+
+        # the stored day before the window, so the first refetched day gets its diffs
+        if self.incremental:
+            df = pd.concat([df, baseline.assign(area="", areaid=-1)], ignore_index=True)
+
+        df = (
+            df.groupby(["date", "area", "areaid", "uid"])[COUNTS]
             .sum()
             .reset_index()
+            .sort_values(by=["uid", "date"], kind="mergesort")
+            .reset_index(drop = True)
         )
 
-        # calc new values per date on cases, deaths, recovered
-        temp = group.groupby(["uid", "date"])[["total_distinct_persons", "total_vaccinations", "total_dose_1", "total_dose_2", "total_dose_3"]]
-        temp = temp.sum().diff().reset_index()
-        
-        mask = temp["uid"] != temp["uid"].shift(1)
-        temp.loc[mask, "total_distinct_persons"] = np.nan
-        temp.loc[mask, "total_vaccinations"] = np.nan
-        temp.loc[mask, "total_dose_1"] = np.nan
-        temp.loc[mask, "total_dose_2"] = np.nan
-        temp.loc[mask, "total_dose_3"] = np.nan
-        
-        # renaming columns
-        temp.columns = [
-            "uid",
-            "date",
-            "new_total_distinct_persons",
-            "new_total_vaccinations",
-            "new_total_dose_1",
-            "new_total_dose_2",
-            "new_total_dose_3",
-        ]
-        
-        # merging new values
-        group = pd.merge(group, temp, on=["uid", "date"])
-        # filling na with 0
-        group = group.fillna(0)
-        
-        group[
-            [
-                "new_total_distinct_persons",
-                "new_total_vaccinations",
-                "new_total_dose_1",
-                "new_total_dose_2",
-                "new_total_dose_3",
-            ]
-        ] = group[
-            [
-                "new_total_distinct_persons",
-                "new_total_vaccinations",
-                "new_total_dose_1",
-                "new_total_dose_2",
-                "new_total_dose_3"
-            ]
-        ].astype(
-            "int"
-        )
-        
-        df = group
-        
-        df.loc[df["date"] == pd.to_datetime(datetime.strptime("2020-12-27", "%Y-%m-%d")), ["new_total_distinct_persons"]] = df["day_total"]
-        df.loc[df["date"] == pd.to_datetime(datetime.strptime("2020-12-27", "%Y-%m-%d")), ["new_total_vaccinations"]] = df["day_total"]
-        df.loc[df["date"] == pd.to_datetime(datetime.strptime("2020-12-27", "%Y-%m-%d")), ["new_total_dose_1"]] = df["day_total"]
-        df.loc[df["date"] == pd.to_datetime(datetime.strptime("2020-12-27", "%Y-%m-%d")), ["new_total_dose_2"]] = np.nan
-        df.loc[df["date"] == pd.to_datetime(datetime.strptime("2020-12-27", "%Y-%m-%d")), ["new_total_dose_3"]] = np.nan
-        # filling na with 0
-        df = df.fillna(0)
-        
-        # fixing data types
-        df[
-            [
-                "total_distinct_persons", "total_vaccinations", "day_total", "day_diff",
-                "total_dose_1", "total_dose_2", "total_dose_3",
-                "daily_dose_1", "daily_dose_2", "daily_dose_3",
-                "new_total_dose_1", "new_total_dose_2", "new_total_dose_3"
-            ]
-        ] = df[
-            [
-                "total_distinct_persons", "total_vaccinations", "day_total", "day_diff",
-                "total_dose_1", "total_dose_2", "total_dose_3", 
-                "daily_dose_1", "daily_dose_2", "daily_dose_3",
-                "new_total_dose_1", "new_total_dose_2", "new_total_dose_3"
-            ]
-        ].astype(
-            "int"
-        )
-        df[
-            ["geo_unit", "state", "region", "population", "lat", "long"]
-        ] = df.apply(
-            lambda x: self._get_fips(x, fips), axis=1, result_type="expand"
-        )
-        
+        # calc new values per date, the first day of each area has none
+        df[NEW_TOTALS] = df.groupby("uid")[TOTALS].diff().values
+        if self.incremental:
+            df = df[df["date"] >= date_from].reset_index(drop = True)
+
+        synthetic = df["date"] == GOVGR_START_DATE
+        for column in ["new_total_distinct_persons", "new_total_vaccinations", "new_total_dose_1"]:
+            df.loc[synthetic, column] = df.loc[synthetic, "day_total"]
+        df.loc[synthetic, ["new_total_dose_2", "new_total_dose_3"]] = np.nan
+
+        # filling na with 0 and fixing data types
+        df[COUNTS + NEW_TOTALS] = df[COUNTS + NEW_TOTALS].fillna(0).astype("int")
+
+        regions = pd.DataFrame.from_dict(dict(fips), orient = "index", columns = REGION_COLUMNS)
+        missing = ~df["areaid"].isin(regions.index)
+        for area in df.loc[missing, "area"].unique():
+            logging.warning("[GOVGR] MISSING FIPS ({})".format(area))
+        regions = regions.reindex(df["areaid"]).reset_index(drop = True)
+        regions.loc[missing.values, REGION_COLUMNS] = ["", "", "", 0, 0.0, 0.0]
+        regions["population"] = regions["population"].astype("int")
+        df[REGION_COLUMNS] = regions
+
+        # the refetched days only recompute their trailing windows over the stored days
+        if self.incremental:
+            history = self.get_history(date_from)
+            metrics = rolling_metrics(
+                pd.concat([history, df[history.columns]], ignore_index=True),
+                METRICS,
+                since=date_from,
+            )
+            df = df.join(metrics.iloc[len(history):].set_index(df.index))
+        else:
+            df = df.join(rolling_metrics(df, METRICS))
+
         df["last_updated_at"] = pd.to_datetime(datetime.today())
         df["source"] = "govgr"
         
         
-        df = df.sort_values(by="date").reset_index(drop = True)
+        df = df.sort_values(by=["date", "uid"]).reset_index(drop = True)
         
         logging.debug("[GOVGR] Shape {}".format(df.shape))
         logging.debug("[GOVGR] Data\n{}".format(df))
@@ -302,32 +344,3 @@ class GovGRStrategy(object):
         self.dataframe = df
         self.save_dataframe()
         return self
-    
-    def get_last_occur_ncd(self, x, df):
-        y = x["date"] - timedelta(days=1)
-        y = y.strftime('%Y-%m-%d')
-        d = df.loc[
-            (df["date"] == y) & (df["uid"] == x["uid"])
-        ]
-        if len(d) == 0:
-            return np.nan, np.nan
-        new_cases = x["cases"] - d.iloc[0]["cases"]
-        new_deaths = x["deaths"] - d.iloc[0]["deaths"] 
-        return new_cases if new_cases > 0 else np.nan, new_deaths if new_deaths > 0 else np.nan
-
-    def _get_fips(self, x, fips):
-        for y in fips:
-            if (
-                y["areaid"] == x["areaid"]
-            ):
-                return (
-                    y["geo_unit"],
-                    y["state"],
-                    y["region"],
-                    y["population"],
-                    y["lat"],
-                    y["long"]
-                )
-
-        logging.warning("[GOVGR] MISSING FIPS ({})".format(x["county"]))
-        return "", "", "", "", 0, 0.0, 0.0
\ No newline at end of file
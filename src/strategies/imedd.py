@@ -1,3 +1,5 @@
+import os
+import hashlib
 import logging
 import time
 import shutil
@@ -7,17 +9,49 @@ import pandas as pd
 import numpy as np
 
 from datetime import datetime, timedelta
-from utils.numerical import calc_fatality_ratio, calc_incidence_rate, calc_available_icus
-from pymongo import ReplaceOne
+from utils.numerical import (
+    fatality_ratio,
+    incidence_rate,
+    available_icus,
+)
+from utils.fingerprint import file_digest, is_unchanged
+from utils.frames import carry_forward, diff_from_last, compact
+from utils.reference import load_reference
+from utils.metrics import rolling_metrics
+
+from utils.artifacts import save_artifact, load_artifact
+from utils.sinks import get_sinks
+from utils.archive import archive_frames
 
 from conf.constants import (
     DATA_IMEDD_BASE_PATH,
+    TIMELINE_COLUMNS,
+    TIMELINE_PAD,
+    TIMELINE_CUMULATIVE,
+    TIMELINE_DTYPES,
     FIX_CORDS,
     EXCLUDE_ROWS,
     REPO_IMEDD_URL,
     COLUMN_MAPPINGS,
+    REFERENCE_COUNTRIES_PATH,
+    REFERENCE_REGIONS_PATH,
+    GLOBAL_SOURCES,
+    GLOBAL_KEYS,
 )
 
+# a row per key, the upserts and the archive match rows on it
+KEYS = ["date", "uid", "region", "source"]
+TIMELINE_KEYS = ["date", "uid", "source"]
+# daily columns with rolling metrics
+METRICS = ["new_cases", "new_deaths"]
+
+
+def load_timeline(output):
+    """
+    The newest timeline artifact and its fingerprint, (None, None) before the first run
+    """
+    return load_artifact(output, "imedd_timeline", __file__)
+
 
 class IMEDDStrategy(object):
     """
@@ -30,23 +64,59 @@ class IMEDDStrategy(object):
         self.dataframe = None
         self.collection = "greece"
         self.docs = []
+        self.timeline = None
+        self.fingerprint = None
+        self.unchanged = False
 
     def clone(self, url, path):
+        if self.config.get("keep_git") and os.path.isdir(path + "/.git"):
+            logging.debug("[IMEDD] Pull Repo {} on {}".format(url, path))
+            Repo(path).remotes.origin.pull()
+            logging.debug("[IMEDD] Repo {} Pulled on {}".format(url, path))
+            return
+
         logging.debug("[IMEDD] Clone Repo {} on {}".format(url, path))
         shutil.rmtree(path, ignore_errors=True)
         Repo.clone_from(url, path)
-        shutil.rmtree(path + "/.git")
+        if not self.config.get("keep_git"):
+            shutil.rmtree(path + "/.git")
         logging.debug("[IMEDD] Repo {} Cloned on {}".format(url, path))
 
     def save_dataframe(self):
-        self.dataframe.to_csv(
-            "{}{}-{}.csv".format(
-                self.config.get("output"),
-                datetime.now().strftime("%Y-%m-%d"),
-                self.name,
-            ),
-            index=False,
+        save_artifact(
+            self.dataframe,
+            self.config.get("output"),
+            self.name,
+            __file__,
+            self.fingerprint,
         )
+        if self.config.get("archive"):
+            archive_frames([self.dataframe], self.config.get("output"), self.name, KEYS)
+
+    def from_cache(self):
+        self.dataframe, self.fingerprint = load_artifact(
+            self.config.get("output"), self.name, __file__
+        )
+        self.timeline, fingerprint = load_artifact(
+            self.config.get("output"), "{}_timeline".format(self.name), __file__
+        )
+        if self.dataframe is None or self.timeline is None:
+            raise Warning("[IMEDD] No cached artifact for {}".format(self.name))
+        if fingerprint != self.fingerprint:
+            raise Warning(
+                "[IMEDD] Cached timeline {} does not match the regions artifact {}".format(
+                    fingerprint, self.fingerprint
+                )
+            )
+        return self
+
+    def release(self):
+        """
+        Drop the frame and documents once they are stored
+        """
+        self.dataframe = None
+        self.docs = []
+        self.timeline = None
 
     def as_docs(self, dataframe):
         docs = []
@@ -63,117 +133,73 @@ class IMEDDStrategy(object):
         return doc
 
     def migrate(self):
-        start = time.time()
-        self.docs = self.as_docs(self.dataframe)
-        coll = (
-            self.config.get("mongo_client")
-            .get_database(self.config.get("db"))
-            .get_collection(self.collection)
-        )
-        if self.config.get("drop"):
-            logging.debug("[IMEDD] Migrate Documents {}".format(len(self.docs)))
-            deleted = coll.delete_many({"source": "imedd"})
-            logging.debug(
-                "[IMEDD] Migration Drop Docs, {} deleted from {} in {}s".format(
-                    deleted.deleted_count,
-                    self.collection,
-                    round(time.time() - start, 2),
+        for sink in get_sinks(self.config, self.name):
+            start = time.time()
+            if self.config.get("drop"):
+                logging.debug("[IMEDD] Migrate Documents {} to {}".format(len(self.dataframe), sink))
+                deleted, inserted = sink.replace(
+                    self.collection, [self.dataframe], self.as_docs, {"source": "imedd"}, keys=KEYS
                 )
-            )
-            result = coll.insert_many(self.docs)
-            logging.debug(
-                "[IMEDD] Migration Completed, {} inserted in {} in {}s".format(
-                    len(result.inserted_ids),
-                    self.collection,
-                    round(time.time() - start, 2),
+                logging.debug(
+                    "[IMEDD] Migration Completed, {} deleted, {} inserted in {} on {} in {}s".format(
+                        deleted,
+                        inserted,
+                        self.collection,
+                        sink,
+                        round(time.time() - start, 2),
+                    )
                 )
-            )
-        else:
-            dates = [pd.to_datetime(datetime.today().strftime("%Y-%m-%d")) - timedelta(days=d) for d in range(5)]
-            reqs = [
-                ReplaceOne(
-                    {
-                        "date": doc["date"],
-                        "uid": doc["uid"],
-                        "region": doc["region"],
-                        "source": doc["source"],
-                    },
-                    doc,
-                    upsert=True,
-                )
-                for doc in self.docs
-                if doc["date"] in dates
-            ]
-            logging.debug("[IMEDD] Migrate Documents {}".format(len(reqs)))
-            result = coll.bulk_write(reqs)
-            logging.debug(
-                "[IMEDD] Migration Completed, {} inserted, {} modified in {} in {}s".format(
-                    result.inserted_count,
-                    result.modified_count,
+            else:
+                dates = [pd.to_datetime(datetime.today().strftime("%Y-%m-%d")) - timedelta(days=d) for d in range(5)]
+                frame = self.dataframe[self.dataframe["date"].isin(dates)]
+                logging.debug("[IMEDD] Migrate Documents {} to {}".format(len(frame), sink))
+                inserted, modified = sink.upsert(
                     self.collection,
-                    round(time.time() - start, 2),
+                    [frame],
+                    self.as_docs,
+                    KEYS,
+                )
+                logging.debug(
+                    "[IMEDD] Migration Completed, {} inserted, {} modified in {} on {} in {}s".format(
+                        inserted,
+                        modified,
+                        self.collection,
+                        sink,
+                        round(time.time() - start, 2),
+                    )
                 )
-            )
             
     def enrich_global(self):
+        """
+        The Greek rows of the global collection when JHU did not migrate in the same run,
+        otherwise JHU writes them merged with its own
+        """
         logging.debug("[IMEDD] Enrich Global")
-        start = time.time()
-        timeline = self.get_timeline();
-        docs = self.as_docs(timeline)
-        coll = (
-            self.config.get("mongo_client")
-            .get_database(self.config.get("db"))
-            .get_collection("global")
-        )
-        if self.config.get("drop"):
-            deleted = coll.delete_many(
-                {
-                    "iso3": "GRC",
-                    "date": { 
-                        "$in": timeline["date"].tolist()
-                    }
-                }
-            )
-            logging.debug(
-                "[IMEDD] Migration Drop Docs, {} deleted from {} in {}s".format(
-                    deleted.deleted_count,
-                    "global",
-                    round(time.time() - start, 2),
-                )
-            )
-            
-            result = coll.insert_many(docs)
-            logging.debug(
-                "[IMEDD] Migration Completed, {} inserted in {} in {}s".format(
-                    len(result.inserted_ids),
-                    "global",
-                    round(time.time() - start, 2),
-                )
-            )
-        else:
+        timeline = self.timeline
+        if timeline is None:
+            timeline, _ = load_timeline(self.config.get("output"))
+        if timeline is None:
+            timeline = self.get_timeline()
+        if not self.config.get("drop"):
             dates = [pd.to_datetime(datetime.today().strftime("%Y-%m-%d")) - timedelta(days=d) for d in range(5)]
-            reqs = [
-                ReplaceOne(
-                    {
-                        "date": doc["date"],
-                        "uid": doc["uid"],
-                        "country": doc["country"],
-                        "iso3": doc["iso3"],
-                        "source": { "$in": ["imedd", "jhu"]}
-                    },
-                    doc,
-                    upsert=True,
-                )
-                for doc in docs
-                if doc["date"] in dates
-            ]
-            logging.debug("[IMEDD] Migrate Documents {}".format(len(reqs)))
-            result = coll.bulk_write(reqs)
+            timeline = timeline[timeline["date"].isin(dates)]
+        for sink in get_sinks(self.config, self.name):
+            start = time.time()
+            logging.debug("[IMEDD] Migrate Documents {} to {}".format(len(timeline), sink))
+            # the iMEdD rows replace the rows of the other global sources for the same date
+            inserted, modified = sink.upsert(
+                "global",
+                [timeline],
+                self.as_docs,
+                GLOBAL_KEYS,
+                {"source": GLOBAL_SOURCES},
+            )
             logging.debug(
-                "[IMEDD] Migration Completed, {} inserted, {} modified in {} in {}s".format(
-                    result.inserted_count,
-                    result.modified_count,
+                "[IMEDD] Migration Completed, {} inserted, {} modified in {} on {} in {}s".format(
+                    inserted,
+                    modified,
                     "global",
+                    sink,
                     round(time.time() - start, 2),
                 )
             )
@@ -187,10 +213,7 @@ class IMEDDStrategy(object):
     def get_timeline(self):
         logging.debug("[IMEDD] Getting Timeline Data")
         
-        fips = pd.read_csv("./data/countries-mapping-jhu-wom.csv")
-        fips = fips.rename(columns=COLUMN_MAPPINGS)
-        
-        greece_fips = fips.loc[(fips["country"] == "Greece")].to_dict("records")
+        greece_fips = load_reference(self.config.get("tmp")).country("Greece")
         df = pd.read_csv(
             self.config.get("tmp")
             + DATA_IMEDD_BASE_PATH
@@ -202,19 +225,13 @@ class IMEDDStrategy(object):
         df = df.rename(columns={"Date": "date", "Status": "status", "Province/State": "state", "Country/Region": "county"})
         dates = df.columns[3:]
         
-         # pivot table using melt
-        df = df.melt(
-            id_vars=[
-                "status"
-            ],
-            value_vars=dates,
-            var_name="date",
-            value_name="value",
-        )
+        # transpose the status rows to columns, one row per date
+        df = df.groupby("status")[dates].mean().T
+        df = df.dropna(how="all").dropna(axis=1, how="all")
+        df.index = pd.to_datetime(df.index, format='%m/%d/%y')
+        df = df.sort_index().rename_axis("date").reset_index()
+        df.columns.name = None
         
-        df["date"] = pd.to_datetime(df["date"], format='%m/%d/%y')
-        df = df.pivot_table("value", ["date"], "status")
-        df = df.reset_index()
         df[
             ["population", "lat", "long", "country", "iso2", "iso3", "uid"]
         ] = [
@@ -226,158 +243,29 @@ class IMEDDStrategy(object):
             greece_fips[0]["iso3"],
             greece_fips[0]["uid"]
         ]
-        df = df.rename(columns={
-            "cases": "new_cases", 
-            "deaths": "new_deaths", 
-            "hospitalized": "new_hospitalized",
-            "total cases": "cases",
-            "intubated": "critical",
-            "estimated_new_total_tests": "new_tests",
-            "cumulative_rtpcr_tests_raw": "tests_rtpcr",
-            "estimated_new_rtpcr_tests": "new_tests_rtpcr",
-            "cumulative_rapid_tests_raw": "tests_rapid",
-            "esitmated_new_rapid_tests": "new_tests_rapid",
-            
-            "icu_discharges": "icu_discharges",
-            "hospital_admissions": "new_hospital_admissions",
-            "hospital_discharges": "new_hospital_discharges",
-            "intubated_unvac": "intubated_unvac",
-            "intubated_vac": "intubated_vac",
-            "icu_occupancy": "icu_occupancy",
-            "beds_occupancy": "beds_occupancy"
-        }) 
+        df = df.rename(columns=TIMELINE_COLUMNS)
         
         # new_hospital_admissions,new_hospital_discharges,icu_occupancy,beds_occupancy
         
-        df["deaths"] = df.new_deaths.cumsum()
-        df["deaths"] = df["deaths"].fillna(method='pad')
-        df["tests"] = df.new_tests.cumsum()
-        df["critical"] = df["critical"].fillna(method='pad')
-        df["recovered"] = df["recovered"].fillna(method='pad')
-        
-        df["icu_discharges"] = df["icu_discharges"].fillna(method='pad')
-        df["new_hospital_admissions"] = df["new_hospital_admissions"] # .fillna(method='pad')
-        df["new_hospital_discharges"] = df["new_hospital_discharges"] # .fillna(method='pad')
-        df["intubated_unvac"] = df["intubated_unvac"].fillna(method='pad')
-        df["intubated_vac"] = df["intubated_vac"].fillna(method='pad')
-        df["icu_occupancy"] = df["icu_occupancy"] # .fillna(method='pad')
-        df["beds_occupancy"] = df["beds_occupancy"] # .fillna(method='pad')
-        
-        group = (
-            df.groupby(
-               ["date", "population", "lat", "long", "country", "iso2", "iso3", "uid"]
-            )[["recovered"]] # , "recovered", "active"
-            .sum()
-            .reset_index()
-        )
-
-        # # calc new values per date on cases, deaths, recovered
-        temp = group.groupby(["uid", "date"])[["recovered"]] # , "recovered"
-        temp = temp.sum().diff().reset_index()
-
-        mask = temp["uid"] != temp["uid"].shift(1)
-        temp.loc[mask, "recovered"] = np.nan
-        # renaming columns
-        temp.columns = [
-            "uid",
-            "date",
-            "new_recovered",
-        ]
-        
-        # merging new values
-        df = pd.merge(df, temp, on=["uid", "date"])
+        # carry the last reported value over the missing dates
+        df[TIMELINE_PAD] = df[TIMELINE_PAD].ffill()
+        df["new_recovered"] = df["recovered"].fillna(0).diff()
         # filling na with 0
         df = df.fillna(0)
-                
-        df["tests"] = df.new_tests.cumsum()
-        df["active"] = df["cases"] - df["deaths"] - df["recovered"]
         
-        df["hospital_admissions"] = df.new_hospital_admissions.cumsum()
-        df["hospital_discharges"] = df.new_hospital_discharges.cumsum()
+        # cumulative values from the daily ones, as a single block
+        df = df.join(
+            df[list(TIMELINE_CUMULATIVE)].cumsum().rename(columns=TIMELINE_CUMULATIVE)
+        )
+        df["active"] = df["cases"] - df["deaths"] - df["recovered"]
 
         # fixing data types
-        df[
-            [
-                "population",
-                "cases",
-                "deaths",
-                "recovered",
-                "active",
-                "new_cases",
-                "new_deaths",
-                "new_recovered",
-                "new_hospitalized", 
-                "intensive_care", 
-                "critical", 
-                
-                "tests_rtpcr",
-                "new_tests_rtpcr", 
-                "tests_rapid",
-                "new_tests_rapid",
-                
-                "tests",
-                "new_tests",
-                
-                "icu_discharges",
-                "hospital_admissions",
-                "hospital_discharges",
-                "new_hospital_admissions",
-                "new_hospital_discharges",
-                "intubated_unvac",
-                "intubated_vac",
-            ]
-        ] = df[
-            [
-                "population",
-                "cases",
-                "deaths",
-                "recovered",
-                "active",
-                "new_cases",
-                "new_deaths",
-                "new_recovered",
-                "new_hospitalized", 
-                "intensive_care", 
-                "critical", 
-                
-                "tests_rtpcr",
-                "new_tests_rtpcr", 
-                "tests_rapid",
-                "new_tests_rapid",
-                
-                "tests",
-                "new_tests",
-                
-                "icu_discharges",
-                "hospital_admissions",
-                "hospital_discharges",
-                "new_hospital_admissions",
-                "new_hospital_discharges",
-                "intubated_unvac",
-                "intubated_vac",
-            ]
-        ].astype(
-            "int"
-        )
-        
-        df[
-            [
-                "icu_occupancy",
-                "beds_occupancy"
-            ]
-        ] = df[
-            [
-                "icu_occupancy",
-                "beds_occupancy"
-            ]
-        ].astype(
-            "float"
-        )
+        df = df.astype(TIMELINE_DTYPES)
 
         # df = group
-        df["case_fatality_ratio"] = df.apply(calc_fatality_ratio, axis=1)
-        df["incidence_rate"] = df.apply(calc_incidence_rate, axis=1)
-        df["icu_availability"] = df.apply(calc_available_icus, axis=1)
+        df["case_fatality_ratio"] = fatality_ratio(df["cases"], df["deaths"])
+        df["incidence_rate"] = incidence_rate(df["cases"], df["population"])
+        df["icu_availability"] = available_icus(df["critical"], df["icu_occupancy"])
         
         df["source"] = "imedd"
         df = df[
@@ -428,16 +316,21 @@ class IMEDDStrategy(object):
         
         df["iso2"] = df["iso2"].str.upper() 
         df["iso3"] = df["iso3"].str.upper() 
+        df = df.join(rolling_metrics(df, METRICS))
         df["last_updated_at"] = pd.to_datetime(datetime.today())
-        df.to_csv(
-            "{}{}-{}-timeline.csv".format(
-                self.config.get("output"),
-                datetime.now().strftime("%Y-%m-%d"),
-                self.name,
-            ),
-            index=False,
+        save_artifact(
+            df,
+            self.config.get("output"),
+            "{}_timeline".format(self.name),
+            __file__,
+            self.fingerprint,
         )
+        if self.config.get("archive"):
+            archive_frames(
+                [df], self.config.get("output"), "{}_timeline".format(self.name), TIMELINE_KEYS
+            )
         
+        self.timeline = df
         return df
         
 
@@ -446,30 +339,37 @@ class IMEDDStrategy(object):
         if self.config.get("clone"):
             self.clone(REPO_IMEDD_URL, self.config.get("tmp") + "imedd")
        
-        fips = pd.read_csv("./data/region-mapping-imedd.csv")
-        fips = fips[fips["uid"].notna()]
-        fips = fips.rename(columns=COLUMN_MAPPINGS).to_dict("records")
+        paths = [
+            self.config.get("tmp") + DATA_IMEDD_BASE_PATH + name
+            for name in [
+                "greece_cases_v2.csv",
+                "greece_deaths_v2.csv",
+                "greece_latest.csv",
+                "greeceTimeline.csv",
+            ]
+        ]
+        # the latest values are dated today, a new day is a change
+        digest = hashlib.sha256(datetime.today().strftime("%Y-%m-%d").encode("utf-8"))
+        self.fingerprint = file_digest(
+            paths
+            + [REFERENCE_REGIONS_PATH, REFERENCE_COUNTRIES_PATH, __file__],
+            digest,
+        )
+        if is_unchanged(self.config, self.name, self.fingerprint):
+            logging.info("[IMEDD] Upstream unchanged, skipping")
+            self.unchanged = True
+            return self
+
+        fips = load_reference(self.config.get("tmp")).region_lookup()
         
         now = pd.to_datetime(datetime.today().strftime("%m/%d/%Y"))
         yesterday = datetime.today() - timedelta(days=1)
         yesterday = yesterday.strftime('%Y-%m-%d')
 
-        confirmed_df = pd.read_csv(
-            self.config.get("tmp")
-            + DATA_IMEDD_BASE_PATH
-            + "greece_cases_v2.csv"
-        )
-        deaths_df = pd.read_csv(
-            self.config.get("tmp")
-            + DATA_IMEDD_BASE_PATH
-            + "greece_deaths_v2.csv"
-        )
+        confirmed_df = pd.read_csv(paths[0])
+        deaths_df = pd.read_csv(paths[1])
         
-        now_df = pd.read_csv(
-            self.config.get("tmp")
-            + DATA_IMEDD_BASE_PATH
-            + "greece_latest.csv"
-        )
+        now_df = pd.read_csv(paths[2])
         now_df = now_df[now_df.county_normalized.notnull()]
 
         logging.debug("[IMEDD] Data Loaded")
@@ -560,10 +460,8 @@ class IMEDDStrategy(object):
         # merging new values
         df = pd.merge(df, temp, on=["uid", "date"])
         # df = group
-        # df[["new_cases", "new_deaths"]] = df.apply(lambda x: self.get_last_occur_ncd(x, df), axis=1, result_type="expand")
         if len(df.loc[df["date"] == now]) == 0:
-            # print(now_df)
-            now_df[["cases", "deaths"]] = now_df.apply(lambda x: self.get_last_occur_cd(x, df), axis=1, result_type="expand")
+            now_df[["cases", "deaths"]] = self.get_last_occur_cd(now_df, df)
             df = df.append(now_df, ignore_index = True)
         
         # filling na with 0
@@ -589,8 +487,8 @@ class IMEDDStrategy(object):
         ].astype(
             "int"
         )
-        df["case_fatality_ratio"] = df.apply(calc_fatality_ratio, axis=1)
-        df["incidence_rate"] = df.apply(calc_incidence_rate, axis=1)
+        df["case_fatality_ratio"] = fatality_ratio(df["cases"], df["deaths"])
+        df["incidence_rate"] = incidence_rate(df["cases"], df["population"])
         df["source"] = "imedd"
         df = df[
             [
@@ -609,8 +507,10 @@ class IMEDDStrategy(object):
                 "source", "lat", "long"
             ]
         ]
+        df = df.join(rolling_metrics(df, METRICS))
         
         df["last_updated_at"] = pd.to_datetime(datetime.today())
+        df = compact(df)
 
         logging.debug("[IMEDD] Shape {}".format(df.shape))
         logging.debug("[IMEDD] Data\n{}".format(df))
@@ -619,48 +519,23 @@ class IMEDDStrategy(object):
         # docs = clean_docs(df.to_dict("records"))
         self.dataframe = df
         self.save_dataframe()
+        # the timeline artifact is read by JHU to write the global collection
+        self.get_timeline()
         return self
 
     def _fix_misc(self, cases, deaths, recovered):
         pass
     
-    def get_last_occur_cd(self, x, df):
-        y = x["date"] - timedelta(days=1)
-        y = y.strftime('%Y-%m-%d')
-        d = df.loc[
-            (df["date"] == y) & (df["uid"] == x["uid"])
-        ]
-        if len(d) == 0:
-            return np.nan, np.nan
-        return d.iloc[0]["cases"] ,d.iloc[0]["deaths"]
+    def get_last_occur_cd(self, target, df):
+        return carry_forward(df, target, ["cases", "deaths"])
     
-    def get_last_occur_ncd(self, x, df):
-        y = x["date"] - timedelta(days=1)
-        y = y.strftime('%Y-%m-%d')
-        d = df.loc[
-            (df["date"] == y) & (df["uid"] == x["uid"])
-        ]
-        if len(d) == 0:
-            return np.nan, np.nan
-        new_cases = x["cases"] - d.iloc[0]["cases"]
-        new_deaths = x["deaths"] - d.iloc[0]["deaths"] 
-        return new_cases if new_cases > 0 else np.nan, new_deaths if new_deaths > 0 else np.nan
+    def get_last_occur_ncd(self, target, df):
+        return diff_from_last(df, target, ["cases", "deaths"])
 
     def _get_fips(self, x, fips):
-        for y in fips:
-            if (
-                y["region_el"] == x["county"] 
-                or y["map_value"] == x["county"]
-            ):
-                return (
-                    y["uid"],
-                    y["geo_unit"],
-                    y["state"],
-                    y["region"],
-                    y["population"],
-                    y["lat"],
-                    y["long"]
-                )
+        y = fips.get(x["county"])
+        if y is not None:
+            return y
 
         logging.warning("[IMEDD] MISSING FIPS ({})".format(x["county"]))
         return "", "", "", "", 0, 0.0, 0.0
\ No newline at end of file
@@ -1,3 +1,5 @@
+import os
+import hashlib
 import logging
 import time
 import shutil
@@ -7,8 +9,15 @@ import pandas as pd
 import numpy as np
 
 from datetime import datetime, timedelta
-from utils.numerical import calc_fatality_ratio, calc_incidence_rate
-from pymongo import ReplaceOne
+from utils.numerical import fatality_ratio, incidence_rate
+from utils.frames import categorize, downcast, compact, by_precedence
+from utils.fingerprint import file_digest, is_unchanged
+from utils.reference import load_reference
+from utils.metrics import rolling_metrics
+
+from utils.artifacts import save_artifact, load_artifact
+from utils.sinks import get_sinks
+from utils.archive import archive_frames
 
 from conf.constants import (
     DATA_JHU_BASE_PATH,
@@ -16,8 +25,17 @@ from conf.constants import (
     EXCLUDE_ROWS,
     REPO_JHU_URL,
     COLUMN_MAPPINGS,
+    REFERENCE_COUNTRIES_PATH,
+    GLOBAL_SOURCES,
+    GLOBAL_KEYS,
+    SOURCE_PRECEDENCE,
 )
 
+# a row per key, the upserts and the archive match rows on it
+KEYS = ["date", "uid", "iso3", "country", "source"]
+# daily columns with rolling metrics
+METRICS = ["new_cases", "new_deaths"]
+
 
 class JHUStrategy(object):
     """
@@ -30,23 +48,51 @@ class JHUStrategy(object):
         self.dataframe = None
         self.collection = "global"
         self.docs = []
+        self.timeline = None
+        self.fingerprint = None
+        self.unchanged = False
 
     def clone(self, url, path):
+        if self.config.get("keep_git") and os.path.isdir(path + "/.git"):
+            logging.debug("[JHU] Pull Repo {} on {}".format(url, path))
+            Repo(path).remotes.origin.pull()
+            logging.debug("[JHU] Repo {} Pulled on {}".format(url, path))
+            return
+
         logging.debug("[JHU] Clone Repo {} on {}".format(url, path))
         shutil.rmtree(path, ignore_errors=True)
         Repo.clone_from(url, path)
-        shutil.rmtree(path + "/.git")
+        if not self.config.get("keep_git"):
+            shutil.rmtree(path + "/.git")
         logging.debug("[JHU] Repo {} Cloned on {}".format(url, path))
 
     def save_dataframe(self):
-        self.dataframe.to_csv(
-            "{}{}-{}.csv".format(
-                self.config.get("output"),
-                datetime.now().strftime("%Y-%m-%d"),
-                self.name,
-            ),
-            index=False,
+        save_artifact(
+            self.dataframe,
+            self.config.get("output"),
+            self.name,
+            __file__,
+            self.fingerprint,
         )
+        if self.config.get("archive"):
+            archive_frames([self.dataframe], self.config.get("output"), self.name, KEYS)
+
+    def from_cache(self):
+        self.dataframe, self.fingerprint = load_artifact(
+            self.config.get("output"), self.name, __file__
+        )
+        if self.dataframe is None:
+            raise Warning("[JHU] No cached artifact for {}".format(self.name))
+        self.timeline, _ = self.load_timeline()
+        return self
+
+    def release(self):
+        """
+        Drop the frame and documents once they are stored
+        """
+        self.dataframe = None
+        self.docs = []
+        self.timeline = None
 
     def as_docs(self, dataframe):
         docs = []
@@ -62,59 +108,71 @@ class JHUStrategy(object):
             doc["loc"] = {"type": "Point", "coordinates": [long, lat]}
         return doc
 
+    def load_timeline(self):
+        # imported here, the iMEdD module is loaded only for its artifact
+        from strategies.imedd import load_timeline
+
+        return load_timeline(self.config.get("output"))
+
+    def frames(self, dates=None):
+        """
+        The JHU rows and the iMEdD timeline, without the rows the other source takes
+        """
+        frames = [self.dataframe]
+        if self.timeline is not None:
+            frames.append(self.timeline)
+        else:
+            logging.warning("[JHU] No iMEdD timeline, Greece from JHU only")
+        if dates is not None:
+            frames = [frame[frame["date"].isin(dates)] for frame in frames]
+        return by_precedence(frames, SOURCE_PRECEDENCE)
+
     def migrate(self):
-        start = time.time()
-        self.docs = self.as_docs(self.dataframe)
-        coll = (
-            self.config.get("mongo_client")
-            .get_database(self.config.get("db"))
-            .get_collection(self.collection)
-        )
-        if self.config.get("drop"):
-            logging.debug("[JHU] Migrate Documents {}".format(len(self.docs)))
-            deleted = coll.delete_many({"source": "jhu"})
-            logging.debug(
-                "[JHU] Migration Drop Docs, {} deleted from {} in {}s".format(
-                    deleted.deleted_count,
+        # without a timeline the iMEdD rows stay as they are
+        match = {"source": GLOBAL_SOURCES if self.timeline is not None else "jhu"}
+        for sink in get_sinks(self.config, self.name):
+            start = time.time()
+            if self.config.get("drop"):
+                logging.debug("[JHU] Migrate Documents {} to {}".format(len(self.dataframe), sink))
+                # the global collection is written once, merged with the other sources
+                deleted, inserted = sink.replace(
                     self.collection,
-                    round(time.time() - start, 2),
+                    self.frames(),
+                    self.as_docs,
+                    match,
+                    keys=GLOBAL_KEYS,
                 )
-            )
-            result = coll.insert_many(self.docs)
-            logging.debug(
-                "[JHU] Migration Completed, {} inserted in {} in {}s".format(
-                    len(result.inserted_ids),
-                    self.collection,
-                    round(time.time() - start, 2),
+                logging.debug(
+                    "[JHU] Migration Completed, {} deleted, {} inserted in {} on {} in {}s".format(
+                        deleted,
+                        inserted,
+                        self.collection,
+                        sink,
+                        round(time.time() - start, 2),
+                    )
                 )
-            )
-        else:
-            dates = [pd.to_datetime(datetime.today().strftime("%Y-%m-%d")) - timedelta(days=d) for d in range(5) if d > 0]
-            reqs = [
-                ReplaceOne(
-                    {
-                        "date": doc["date"],
-                        "uid": doc["uid"],
-                        "iso3": doc["iso3"],
-                        "country": doc["country"],
-                        "source": doc["source"],
-                    },
-                    doc,
-                    upsert=True,
+            else:
+                dates = [pd.to_datetime(datetime.today().strftime("%Y-%m-%d")) - timedelta(days=d) for d in range(5) if d > 0]
+                frames = self.frames(dates)
+                logging.debug(
+                    "[JHU] Migrate Documents {} to {}".format(sum(len(f) for f in frames), sink)
                 )
-                for doc in self.docs
-                if doc["date"] in dates
-            ]
-            logging.debug("[JHU] Migrate Documents {}".format(len(reqs)))
-            result = coll.bulk_write(reqs)
-            logging.debug(
-                "[JHU] Migration Completed, {} inserted, {} modified in {} in {}s".format(
-                    result.inserted_count,
-                    result.modified_count,
+                inserted, modified = sink.upsert(
                     self.collection,
-                    round(time.time() - start, 2),
+                    frames,
+                    self.as_docs,
+                    GLOBAL_KEYS,
+                    match,
+                )
+                logging.debug(
+                    "[JHU] Migration Completed, {} inserted, {} modified in {} on {} in {}s".format(
+                        inserted,
+                        modified,
+                        self.collection,
+                        sink,
+                        round(time.time() - start, 2),
+                    )
                 )
-            )
 
     def clean(self):
         pass
@@ -127,24 +185,28 @@ class JHUStrategy(object):
         if self.config.get("clone"):
             self.clone(REPO_JHU_URL, self.config.get("tmp") + "jhu")
 
-        fips = pd.read_csv("./data/countries-mapping-jhu-wom.csv")
-        fips = fips.rename(columns=COLUMN_MAPPINGS).to_dict("records")
+        paths = [
+            self.config.get("tmp") + DATA_JHU_BASE_PATH + name
+            for name in [
+                "time_series_covid19_confirmed_global.csv",
+                "time_series_covid19_deaths_global.csv",
+                "time_series_covid19_recovered_global.csv",
+            ]
+        ]
+        # the global collection holds the iMEdD timeline too, a new one is a change
+        self.timeline, timeline = self.load_timeline()
+        digest = hashlib.sha256((timeline or "").encode("utf-8"))
+        self.fingerprint = file_digest(paths + [REFERENCE_COUNTRIES_PATH, __file__], digest)
+        if is_unchanged(self.config, self.name, self.fingerprint):
+            logging.info("[JHU] Upstream unchanged, skipping")
+            self.unchanged = True
+            return self
 
-        confirmed_df = pd.read_csv(
-            self.config.get("tmp")
-            + DATA_JHU_BASE_PATH
-            + "time_series_covid19_confirmed_global.csv"
-        )
-        deaths_df = pd.read_csv(
-            self.config.get("tmp")
-            + DATA_JHU_BASE_PATH
-            + "time_series_covid19_deaths_global.csv"
-        )
-        recovered_df = pd.read_csv(
-            self.config.get("tmp")
-            + DATA_JHU_BASE_PATH
-            + "time_series_covid19_recovered_global.csv"
-        )
+        fips = load_reference(self.config.get("tmp")).country_lookup()
+
+        confirmed_df = pd.read_csv(paths[0])
+        deaths_df = pd.read_csv(paths[1])
+        recovered_df = pd.read_csv(paths[2])
 
         logging.debug("[JHU] Data Loaded")
 
@@ -202,6 +264,12 @@ class JHUStrategy(object):
         # recovered_df = recovered_df[recovered_df['Country/Region']!='Canada']
         
         dates = confirmed_df.columns[4:-7]
+        # compact the columns melt repeats for every date
+        frames = [confirmed_df, deaths_df, recovered_df]
+        categorize(frames, ["Province/State", "Country/Region", "Lat", "Long"])
+        categorize(frames, ["population", "lat", "long", "country", "iso2", "iso3", "uid"])
+        for frame in frames:
+            downcast(frame, frame.columns.intersection(dates))
         # pivot table using melt
         confirmed_df = confirmed_df.melt(
             id_vars=[
@@ -293,6 +361,8 @@ class JHUStrategy(object):
             inplace=True,
         )
 
+        categorize([confirmed_df, deaths_df, recovered_df], ["Date"])
+
         # merge data from deaths and confirmed to df
         df = confirmed_df.merge(
             right=deaths_df,
@@ -310,7 +380,10 @@ class JHUStrategy(object):
         df = df.rename(columns=COLUMN_MAPPINGS)
 
         logging.debug("[JHU] Data Cleaned & Merged, Building...")
-        df["date"] = pd.to_datetime(df["date"], format='%m/%d/%y')
+        # parse each distinct date once
+        df["date"] = pd.to_datetime(
+            df["date"].cat.categories, format='%m/%d/%y'
+        )[df["date"].cat.codes].values
         
         # df = df.groupby(["date", "population", "lat", "long", "country", "iso2", "iso3", "uid"])["cases", "deaths", "recovered"].sum().reset_index()
         df["recovered"] = df["recovered"].fillna(0)
@@ -319,14 +392,15 @@ class JHUStrategy(object):
         
         group = (
             df.groupby(
-                ["date", "population", "lat", "long", "country", "iso2", "iso3", "uid"]
+                ["date", "population", "lat", "long", "country", "iso2", "iso3", "uid"],
+                observed=True,
             )[["cases", "deaths", "recovered", "active"]]
             .sum()
             .reset_index()
         )
 
         # calc new values per date on cases, deaths, recovered
-        temp = group.groupby(["country", "date"])[["cases", "deaths", "recovered"]]
+        temp = group.groupby(["country", "date"], observed=True)[["cases", "deaths", "recovered"]]
         temp = temp.sum().diff().reset_index()
         
         mask = temp["country"] != temp["country"].shift(1)
@@ -345,8 +419,10 @@ class JHUStrategy(object):
         
         # merging new values
         group = pd.merge(group, temp, on=["country", "date"])
-        # filling na with 0
-        group = group.fillna(0)
+        # filling na with 0, only the new values have any
+        group[["new_cases", "new_deaths", "new_recovered"]] = group[
+            ["new_cases", "new_deaths", "new_recovered"]
+        ].fillna(0)
 
         # fixing data types
         group[
@@ -376,8 +452,8 @@ class JHUStrategy(object):
         )
 
         df = group
-        df["case_fatality_ratio"] = df.apply(calc_fatality_ratio, axis=1)
-        df["incidence_rate"] = df.apply(calc_incidence_rate, axis=1)
+        df["case_fatality_ratio"] = fatality_ratio(df["cases"], df["deaths"])
+        df["incidence_rate"] = incidence_rate(df["cases"], df["population"])
         df["source"] = "jhu"
         df["last_updated_at"] = pd.to_datetime(datetime.today())
         df = df[
@@ -403,6 +479,10 @@ class JHUStrategy(object):
                 "last_updated_at"
             ]
         ]
+        # countries without fips share a uid, the daily values are per country
+        df = df.join(rolling_metrics(df, METRICS, by="country"))
+
+        df = compact(df)
 
         logging.debug("[JHU] Shape {}".format(df.shape))
         logging.debug("[JHU] Data\n{}".format(df))
@@ -464,21 +544,9 @@ class JHUStrategy(object):
         ] = "Macau"
 
     def _get_fips(self, x, fips):
-        for y in fips:
-            if (
-                y["name_en"] == x["Country/Region"]
-                or y["country"] == x["Country/Region"]
-                or y["wom_map"] == x["Country/Region"]
-            ):
-                return (
-                    int(y["population"]),
-                    float(y["lat"]),
-                    float(y["long"]),
-                    y["name_en"],
-                    y["iso2"].upper(),
-                    y["iso3"].upper(),
-                    y["uid"],
-                )
+        y = fips.get(x["Country/Region"])
+        if y is not None:
+            return y
 
         logging.warning("[JHU] MISSING FIPS ({})".format(x["Country/Region"]))
         return x["Country/Region"], 0.0, 0.0, x["Country/Region"], "", "", 0
@@ -0,0 +1,295 @@
+import os
+import glob
+import hashlib
+import logging
+import time
+import shutil
+
+from concurrent.futures import ProcessPoolExecutor
+
+from git import Repo
+import pandas as pd
+
+from datetime import datetime
+from utils.numerical import fatality_ratio, incidence_rate
+from utils.frames import compact
+from utils.fingerprint import file_digest, is_unchanged, load_manifest, save_manifest
+from utils.reference import load_reference
+
+from utils.artifacts import save_artifact, load_artifact, partition_dir, prune_partitions
+from utils.sinks import get_sinks
+from utils.archive import archive_frames
+
+from conf.constants import (
+    DATA_JHU_DAILY_PATH,
+    REPO_JHU_URL,
+    DAILY_REPORT_MAPPINGS,
+    DAILY_REPORT_COUNTS,
+    DAILY_REPORT_COUNTRY_ALIASES,
+)
+
+COLUMNS = [
+    "date",
+    "uid",
+    "iso2",
+    "iso3",
+    "country",
+    "state",
+    "lat",
+    "long",
+    "cases",
+    "deaths",
+    "recovered",
+    "active",
+    "tests",
+    "case_fatality_ratio",
+    "incidence_rate",
+    "testing_rate",
+    "source",
+    "last_update",
+    "last_updated_at",
+]
+
+
+def parse_report(path, output):
+    """
+    One daily report normalized to a row per country and province,
+    written as a partition. Runs in a worker process
+    """
+    name = os.path.basename(path)[: -len(".csv")]
+    df = pd.read_csv(path).rename(columns=DAILY_REPORT_MAPPINGS)
+    for column in DAILY_REPORT_COUNTS + ["state", "lat", "long", "incidence_rate", "last_update"]:
+        if column not in df.columns:
+            df[column] = float("nan")
+
+    # renamed countries are summed under their current name
+    df["country"] = df["country"].str.strip().replace(DAILY_REPORT_COUNTRY_ALIASES)
+    df["state"] = df["state"].fillna("").astype(str).str.strip()
+    df["last_update"] = pd.to_datetime(df["last_update"], errors="coerce")
+    # later reports are per county, the population behind each incidence rate
+    # lets the province rollup recompute the rates
+    df["population"] = (df["cases"] * 100000.0 / df["incidence_rate"]).where(
+        df["incidence_rate"] > 0
+    )
+
+    df = (
+        df.groupby(["country", "state"])
+        .agg(
+            {
+                "cases": lambda x: x.sum(min_count=1),
+                "deaths": lambda x: x.sum(min_count=1),
+                "recovered": lambda x: x.sum(min_count=1),
+                "active": lambda x: x.sum(min_count=1),
+                "tests": lambda x: x.sum(min_count=1),
+                "population": lambda x: x.sum(min_count=1),
+                "lat": "mean",
+                "long": "mean",
+                "last_update": "max",
+            }
+        )
+        .reset_index()
+    )
+    df[["cases", "deaths"]] = df[["cases", "deaths"]].fillna(0).astype("int")
+    df["active"] = df["active"].fillna(df["cases"] - df["deaths"] - df["recovered"])
+    df["case_fatality_ratio"] = fatality_ratio(df["cases"], df["deaths"])
+    df["incidence_rate"] = incidence_rate(df["cases"], df["population"])
+    df["testing_rate"] = incidence_rate(df["tests"], df["population"])
+    df["date"] = pd.to_datetime(name, format="%m-%d-%Y")
+    df = df.drop(columns=["population"])
+
+    df.to_parquet("{}{}.parquet".format(output, name), index=False)
+    return name, len(df)
+
+
+# a row per key, the upserts and the archive match rows on it
+KEYS = ["date", "country", "state", "source"]
+
+
+class JHUDailyStrategy(object):
+    """
+    JHUDailyStrategy
+    """
+
+    def __init__(self, name=None, config=None, mongo=None):
+        self.name = name if name != None else type(self).__name__
+        self.config = config[0] if config != None else {}
+        self.dataframe = None
+        self.collection = "provinces"
+        self.docs = []
+        self.dates = None
+        self.files = {}
+        self.fingerprint = None
+        self.unchanged = False
+
+    def clone(self, url, path):
+        if self.config.get("keep_git") and os.path.isdir(path + "/.git"):
+            logging.debug("[JHU-DAILY] Pull Repo {} on {}".format(url, path))
+            Repo(path).remotes.origin.pull()
+            logging.debug("[JHU-DAILY] Repo {} Pulled on {}".format(url, path))
+            return
+
+        logging.debug("[JHU-DAILY] Clone Repo {} on {}".format(url, path))
+        shutil.rmtree(path, ignore_errors=True)
+        Repo.clone_from(url, path)
+        if not self.config.get("keep_git"):
+            shutil.rmtree(path + "/.git")
+        logging.debug("[JHU-DAILY] Repo {} Cloned on {}".format(url, path))
+
+    def save_dataframe(self):
+        save_artifact(
+            self.dataframe,
+            self.config.get("output"),
+            self.name,
+            __file__,
+            self.fingerprint,
+        )
+        if self.config.get("archive"):
+            archive_frames([self.dataframe], self.config.get("output"), self.name, KEYS)
+
+    def from_cache(self):
+        self.dataframe, self.fingerprint = load_artifact(
+            self.config.get("output"), self.name, __file__
+        )
+        if self.dataframe is None:
+            raise Warning("[JHU-DAILY] No cached artifact for {}".format(self.name))
+        return self
+
+    def release(self):
+        """
+        Drop the frame and documents once they are stored
+        """
+        self.dataframe = None
+        self.docs = []
+
+    def as_docs(self, dataframe):
+        docs = []
+        for doc in dataframe.to_dict("records"):
+            for key in ["state", "recovered", "active", "tests", "testing_rate", "last_update"]:
+                if doc.get(key) is None or doc[key] != doc[key] or doc[key] == "":
+                    doc.pop(key, None)
+            doc = self.geo_loc(doc)
+            docs.append(doc)
+        return docs
+
+    def geo_loc(self, doc):
+        lat = float(doc.pop("lat", 0.0))
+        long = float(doc.pop("long", 0.0))
+        if lat == lat and long == long and lat != 0.0 and long != 0.0:
+            doc["loc"] = {"type": "Point", "coordinates": [long, lat]}
+        return doc
+
+    def migrate(self):
+        frame, match = self.dataframe, {"source": "jhu"}
+        if not self.config.get("drop") and self.dates is not None:
+            # only the days whose report changed since the last run, replaced
+            # as a whole so provinces JHU renamed or merged are removed too
+            frame = frame[frame["date"].isin(self.dates)]
+            match = dict(match, date=self.dates)
+        for sink in get_sinks(self.config, self.name):
+            start = time.time()
+            logging.debug("[JHU-DAILY] Migrate Documents {} to {}".format(len(frame), sink))
+            deleted, inserted = sink.replace(
+                self.collection, [frame], self.as_docs, match, keys=KEYS
+            )
+            logging.debug(
+                "[JHU-DAILY] Migration Completed, {} deleted, {} inserted in {} on {} in {}s".format(
+                    deleted,
+                    inserted,
+                    self.collection,
+                    sink,
+                    round(time.time() - start, 2),
+                )
+            )
+        if len(self.files) > 0:
+            save_manifest(self.config, self.name, self.files)
+
+    def get(self):
+        logging.debug("[JHU-DAILY] Getting Data")
+        if self.config.get("clone"):
+            self.clone(REPO_JHU_URL, self.config.get("tmp") + "jhu")
+
+        paths = sorted(glob.glob(self.config.get("tmp") + DATA_JHU_DAILY_PATH + "*.csv"))
+        files = {os.path.basename(path): file_digest([path]) for path in paths}
+        digest = hashlib.sha256()
+        for name in sorted(files):
+            digest.update("{}:{}\n".format(name, files[name]).encode("utf-8"))
+        self.fingerprint = file_digest([__file__], digest)
+        if is_unchanged(self.config, self.name, self.fingerprint):
+            logging.info("[JHU-DAILY] Upstream unchanged, skipping")
+            self.unchanged = True
+            return self
+
+        # parsed reports are kept per file, only new or edited files are parsed again
+        output = partition_dir(
+            self.config.get("output"), self.name + "_reports", __file__, "parsed"
+        )
+        prune_partitions(self.config.get("output"), self.name + "_reports", output)
+        manifest = load_manifest(self.config, self.name)
+        changed = [
+            path
+            for path in paths
+            if manifest.get(os.path.basename(path)) != files[os.path.basename(path)]
+            or not os.path.isfile(
+                "{}{}.parquet".format(output, os.path.basename(path)[: -len(".csv")])
+            )
+        ]
+        for name in set(manifest) - set(files):
+            path = "{}{}.parquet".format(output, name[: -len(".csv")])
+            if os.path.isfile(path):
+                os.remove(path)
+        logging.debug(
+            "[JHU-DAILY] {} of {} reports changed".format(len(changed), len(paths))
+        )
+
+        rows = 0
+        workers = self.config.get("workers") or None
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for name, n in executor.map(
+                parse_report, changed, [output] * len(changed), chunksize=16
+            ):
+                rows += n
+        self.files = files
+        logging.debug("[JHU-DAILY] {} reports parsed, {} rows".format(len(changed), rows))
+
+        # a full rewrite when every report was parsed again, the manifest
+        # is stored after the migration so failed runs are parsed again
+        self.dates = (
+            None
+            if len(changed) == len(paths)
+            else [
+                pd.to_datetime(os.path.basename(path)[: -len(".csv")], format="%m-%d-%Y")
+                for path in changed
+            ]
+        )
+
+        df = pd.concat(
+            [
+                pd.read_parquet("{}{}.parquet".format(output, name[: -len(".csv")]))
+                for name in sorted(files)
+            ],
+            ignore_index=True,
+        )
+
+        fips = load_reference(self.config.get("tmp")).country_lookup()
+        missing = sorted(set(df["country"].unique()) - set(fips))
+        if len(missing) > 0:
+            logging.warning("[JHU-DAILY] MISSING FIPS ({})".format(", ".join(missing)))
+        countries = pd.DataFrame(
+            [
+                (country,) + (fips[country][4:7] if country in fips else (None, None, None))
+                for country in df["country"].unique()
+            ],
+            columns=["country", "iso2", "iso3", "uid"],
+        )
+        df = df.merge(countries, how="left", on="country")
+        df["source"] = "jhu"
+        df["last_updated_at"] = pd.to_datetime(datetime.today())
+        df = compact(df[COLUMNS])
+
+        logging.debug("[JHU-DAILY] Shape {}".format(df.shape))
+        logging.debug("[JHU-DAILY] Data\n{}".format(df))
+        logging.debug("[JHU-DAILY] Done!")
+
+        self.dataframe = df
+        self.save_dataframe()
+        return self
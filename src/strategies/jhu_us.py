@@ -0,0 +1,411 @@
+import os
+import re
+import logging
+import time
+import shutil
+
+from concurrent.futures import ProcessPoolExecutor
+
+from git import Repo
+import pandas as pd
+
+from datetime import datetime, timedelta
+from utils.numerical import fatality_ratio, incidence_rate
+from utils.frames import compact
+from utils.fingerprint import file_digest, is_unchanged
+from utils.reference import load_reference
+
+from utils.artifacts import (
+    save_artifact,
+    load_artifact,
+    partition_dir,
+    load_partitions,
+    prune_partitions,
+)
+from utils.sinks import get_sinks
+from utils.archive import archive_frames
+
+from conf.constants import (
+    DATA_JHU_BASE_PATH,
+    DATA_JHU_UID_LOOKUP_PATH,
+    REPO_JHU_URL,
+    COLUMN_MAPPINGS,
+    JHU_US_CHUNK_ROWS,
+    JHU_US_ID_COLUMNS,
+    JHU_US_EXCLUDE_STATES,
+)
+
+COLUMNS = [
+    "date",
+    "uid",
+    "fips",
+    "iso2",
+    "iso3",
+    "country",
+    "state",
+    "admin_2",
+    "geo_unit",
+    "lat",
+    "long",
+    "population",
+    "cases",
+    "deaths",
+    "new_cases",
+    "new_deaths",
+    "case_fatality_ratio",
+    "incidence_rate",
+    "source",
+    "last_updated_at",
+]
+
+
+def _slug(value):
+    return re.sub(r"[^0-9A-Za-z]+", "_", value).strip("_").lower()
+
+
+def _new_values(df, by=None):
+    columns = ["cases", "deaths"]
+    diff = df.groupby(by)[columns].diff() if by else df[columns].diff()
+    df["new_cases"] = diff["cases"].fillna(0)
+    df["new_deaths"] = diff["deaths"].fillna(0)
+    return df
+
+
+def _finish(df, last_updated_at):
+    df["case_fatality_ratio"] = fatality_ratio(df["cases"], df["deaths"])
+    df["incidence_rate"] = incidence_rate(df["cases"], df["population"])
+    df["source"] = "jhu"
+    df["last_updated_at"] = last_updated_at
+    df[["population", "cases", "deaths", "new_cases", "new_deaths"]] = df[
+        ["population", "cases", "deaths", "new_cases", "new_deaths"]
+    ].astype("int")
+    return compact(df[COLUMNS])
+
+
+def _centroid(ids):
+    located = ids[(ids["lat"] != 0) & (ids["long"] != 0) & ids["lat"].notna()]
+    if len(located) == 0:
+        return 0.0, 0.0
+    weights = located["population"].clip(lower=1)
+    return (
+        float((located["lat"] * weights).sum() / weights.sum()),
+        float((located["long"] * weights).sum() / weights.sum()),
+    )
+
+
+def build_state(state, confirmed_path, deaths_path, output, last_updated_at, uid=None, fips=None):
+    """
+    County rows of one state written as a partition, returns the state rollup.
+    Runs in a worker process so only one state is in its memory at a time
+    """
+    confirmed = pd.read_csv(confirmed_path)
+    deaths = pd.read_csv(deaths_path)
+    dates = [c for c in confirmed.columns if c not in JHU_US_ID_COLUMNS]
+    parsed = dict(zip(dates, pd.to_datetime(dates, format="%m/%d/%y")))
+
+    ids = deaths[[c for c in JHU_US_ID_COLUMNS if c in deaths.columns]]
+    ids = ids.rename(columns=COLUMN_MAPPINGS)
+    ids["fips"] = ids["fips"].map(
+        lambda f: "{:05d}".format(int(f)) if pd.notna(f) else None
+    )
+    ids["population"] = ids["population"].fillna(0)
+
+    confirmed = confirmed.melt(
+        id_vars=["UID"], value_vars=dates, var_name="date", value_name="cases"
+    )
+    deaths = deaths.melt(
+        id_vars=["UID"], value_vars=dates, var_name="date", value_name="deaths"
+    )
+    df = confirmed.merge(deaths, how="left", on=["UID", "date"])
+    df = df.rename(columns=COLUMN_MAPPINGS).merge(ids, how="left", on="uid")
+    df["date"] = df["date"].map(parsed)
+    df[["cases", "deaths"]] = df[["cases", "deaths"]].fillna(0)
+    df["geo_unit"] = "admin_2"
+    df = df.sort_values(["uid", "date"])
+    df = _finish(_new_values(df, "uid"), last_updated_at)
+
+    path = "{}{}.parquet".format(output, _slug(state))
+    df.to_parquet(path, index=False)
+    counties = len(ids)
+    rows = len(df)
+    del df
+
+    rollup = confirmed.rename(columns=COLUMN_MAPPINGS).groupby("date")[["cases"]].sum()
+    rollup["deaths"] = deaths.groupby("date")["deaths"].sum()
+    rollup = rollup.reset_index()
+    rollup["date"] = rollup["date"].map(parsed)
+    rollup = rollup.sort_values("date")
+    rollup["lat"], rollup["long"] = _centroid(ids)
+    rollup["uid"] = uid
+    rollup["fips"] = fips
+    rollup["iso2"] = "US"
+    rollup["iso3"] = "USA"
+    rollup["country"] = "US"
+    rollup["state"] = state
+    rollup["admin_2"] = None
+    rollup["geo_unit"] = "state"
+    rollup["population"] = ids["population"].sum()
+    rollup = _finish(_new_values(rollup), last_updated_at)
+    return rollup, counties, rows
+
+
+# a row per key, the upserts and the archive match rows on it
+KEYS = ["date", "uid", "source"]
+
+
+class JHUUSStrategy(object):
+    """
+    JHUUSStrategy
+    """
+
+    def __init__(self, name=None, config=None, mongo=None):
+        self.name = name if name != None else type(self).__name__
+        self.config = config[0] if config != None else {}
+        self.dataframe = None
+        self.partitions = []
+        self.collection = "us"
+        self.docs = []
+        self.fingerprint = None
+        self.unchanged = False
+
+    def clone(self, url, path):
+        if self.config.get("keep_git") and os.path.isdir(path + "/.git"):
+            logging.debug("[JHU-US] Pull Repo {} on {}".format(url, path))
+            Repo(path).remotes.origin.pull()
+            logging.debug("[JHU-US] Repo {} Pulled on {}".format(url, path))
+            return
+
+        logging.debug("[JHU-US] Clone Repo {} on {}".format(url, path))
+        shutil.rmtree(path, ignore_errors=True)
+        Repo.clone_from(url, path)
+        if not self.config.get("keep_git"):
+            shutil.rmtree(path + "/.git")
+        logging.debug("[JHU-US] Repo {} Cloned on {}".format(url, path))
+
+    def save_dataframe(self):
+        save_artifact(
+            self.dataframe,
+            self.config.get("output"),
+            self.name,
+            __file__,
+            self.fingerprint,
+        )
+        if self.config.get("archive"):
+            archive_frames(self.frames(), self.config.get("output"), self.name, KEYS)
+
+    def from_cache(self):
+        self.dataframe, self.fingerprint = load_artifact(
+            self.config.get("output"), self.name, __file__
+        )
+        if self.dataframe is None:
+            raise Warning("[JHU-US] No cached artifact for {}".format(self.name))
+        self.partitions = load_partitions(
+            self.config.get("output"), self.name + "_counties", __file__, self.fingerprint
+        )
+        return self
+
+    def release(self):
+        """
+        Drop the frame and documents once they are stored
+        """
+        self.dataframe = None
+        self.docs = []
+
+    def as_docs(self, dataframe):
+        docs = []
+        for doc in dataframe.to_dict("records"):
+            for key in ["fips", "state", "admin_2"]:
+                if doc.get(key) is None or doc[key] != doc[key]:
+                    doc.pop(key, None)
+            doc = self.geo_loc(doc)
+            docs.append(doc)
+        return docs
+
+    def geo_loc(self, doc):
+        lat = float(doc.pop("lat", 0.0))
+        long = float(doc.pop("long", 0.0))
+        if lat != 0.0 and long != 0.0:
+            doc["loc"] = {"type": "Point", "coordinates": [long, lat]}
+        return doc
+
+    def frames(self, dates=None):
+        """
+        County partitions one at a time, then the state and country rollups
+        """
+        for path in self.partitions + [None]:
+            frame = self.dataframe if path is None else pd.read_parquet(path)
+            if dates is not None:
+                frame = frame[frame["date"].isin(dates)]
+            yield frame
+
+    def migrate(self):
+        for sink in get_sinks(self.config, self.name):
+            start = time.time()
+            if self.config.get("drop"):
+                logging.debug(
+                    "[JHU-US] Migrate Documents from {} partitions to {}".format(
+                        len(self.partitions), sink
+                    )
+                )
+                deleted, inserted = sink.replace(
+                    self.collection, self.frames(), self.as_docs, {"source": "jhu"}, keys=KEYS
+                )
+                logging.debug(
+                    "[JHU-US] Migration Completed, {} deleted, {} inserted in {} on {} in {}s".format(
+                        deleted,
+                        inserted,
+                        self.collection,
+                        sink,
+                        round(time.time() - start, 2),
+                    )
+                )
+            else:
+                dates = [pd.to_datetime(datetime.today().strftime("%Y-%m-%d")) - timedelta(days=d) for d in range(5) if d > 0]
+                inserted, modified = sink.upsert(
+                    self.collection,
+                    self.frames(dates),
+                    self.as_docs,
+                    KEYS,
+                )
+                logging.debug(
+                    "[JHU-US] Migration Completed, {} inserted, {} modified in {} on {} in {}s".format(
+                        inserted,
+                        modified,
+                        self.collection,
+                        sink,
+                        round(time.time() - start, 2),
+                    )
+                )
+
+    def get(self):
+        logging.debug("[JHU-US] Getting Data")
+        if self.config.get("clone"):
+            self.clone(REPO_JHU_URL, self.config.get("tmp") + "jhu")
+
+        paths = [
+            self.config.get("tmp") + DATA_JHU_BASE_PATH + name
+            for name in [
+                "time_series_covid19_confirmed_US.csv",
+                "time_series_covid19_deaths_US.csv",
+            ]
+        ]
+        lookup = self.config.get("tmp") + DATA_JHU_UID_LOOKUP_PATH
+        self.fingerprint = file_digest(paths + [lookup, __file__])
+        if is_unchanged(self.config, self.name, self.fingerprint):
+            logging.info("[JHU-US] Upstream unchanged, skipping")
+            self.unchanged = True
+            return self
+
+        # split both files per state, reading a few hundred counties at a time
+        spool = self.config.get("tmp") + "jhu_us/"
+        shutil.rmtree(spool, ignore_errors=True)
+        os.makedirs(spool)
+        states = self._spool(paths[0], spool + "confirmed-")
+        self._spool(paths[1], spool + "deaths-")
+        logging.debug("[JHU-US] Data Split in {} states".format(len(states)))
+
+        uids = self.state_uids(lookup)
+        missing = sorted(set(states) - set(uids))
+        if len(missing) > 0:
+            logging.warning(
+                "[JHU-US] MISSING UID ({}), counted in the country only".format(", ".join(missing))
+            )
+
+        output = partition_dir(
+            self.config.get("output"), self.name + "_counties", __file__, self.fingerprint
+        )
+        last_updated_at = pd.to_datetime(datetime.today())
+        rollups = []
+        counties = rows = 0
+        workers = self.config.get("workers") or None
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    build_state,
+                    state,
+                    "{}confirmed-{}.csv".format(spool, _slug(state)),
+                    "{}deaths-{}.csv".format(spool, _slug(state)),
+                    output,
+                    last_updated_at,
+                    *uids.get(state, (None, None))
+                )
+                for state in sorted(states)
+            ]
+            for future in futures:
+                rollup, n, r = future.result()
+                rollups.append(rollup)
+                counties += n
+                rows += r
+        shutil.rmtree(spool, ignore_errors=True)
+        prune_partitions(self.config.get("output"), self.name + "_counties", output)
+        logging.debug(
+            "[JHU-US] {} counties, {} rows written to {}".format(counties, rows, output)
+        )
+
+        states = pd.concat(rollups, ignore_index=True)
+        country = (
+            states.groupby("date")[["cases", "deaths", "population"]]
+            .sum()
+            .reset_index()
+        )
+        fips = load_reference(self.config.get("tmp")).country_lookup().get("US")
+        country["lat"] = fips[1] if fips else 0.0
+        country["long"] = fips[2] if fips else 0.0
+        country["uid"] = 840
+        country["fips"] = None
+        country["iso2"] = "US"
+        country["iso3"] = "USA"
+        country["country"] = "US"
+        country["state"] = None
+        country["admin_2"] = None
+        country["geo_unit"] = "country"
+        country = _finish(_new_values(country), last_updated_at)
+        # a state without a JHU uid has no row of its own
+        states = states[states["uid"].notna()].astype({"uid": "int64"})
+
+        df = pd.concat(
+            [states.astype({c: "object" for c in states.select_dtypes("category")}), country],
+            ignore_index=True,
+        )
+        df = compact(df)
+
+        logging.debug("[JHU-US] Shape {}".format(df.shape))
+        logging.debug("[JHU-US] Data\n{}".format(df))
+        logging.debug("[JHU-US] Done!")
+
+        self.dataframe = df
+        self.partitions = load_partitions(
+            self.config.get("output"), self.name + "_counties", __file__, self.fingerprint
+        )
+        self.save_dataframe()
+        return self
+
+    def state_uids(self, path):
+        """
+        JHU uid and fips per state and territory, from the lookup table the county uids come from
+        """
+        lookup = pd.read_csv(path, usecols=["UID", "FIPS", "Admin2", "Province_State", "Country_Region"])
+        lookup = lookup[
+            (lookup["Country_Region"] == "US")
+            & lookup["Admin2"].isna()
+            & lookup["Province_State"].notna()
+        ]
+        return {
+            row["Province_State"]: (
+                int(row["UID"]),
+                "{:02d}".format(int(row["FIPS"])) if pd.notna(row["FIPS"]) else None,
+            )
+            for row in lookup.to_dict("records")
+        }
+
+    def _spool(self, path, prefix):
+        states = set()
+        for chunk in pd.read_csv(path, chunksize=JHU_US_CHUNK_ROWS):
+            chunk = chunk[~chunk["Province_State"].isin(JHU_US_EXCLUDE_STATES)]
+            for state, rows in chunk.groupby("Province_State", sort=False):
+                target = "{}{}.csv".format(prefix, _slug(state))
+                rows.to_csv(
+                    target, mode="a", header=not os.path.exists(target), index=False
+                )
+                states.add(state)
+        return states
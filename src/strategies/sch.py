@@ -1,25 +1,31 @@
+import re
+import math
+import time
 import logging
-import requests
+
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
-import numpy as np
 
 from datetime import datetime
-from bs4 import BeautifulSoup
-from utils.numerical import (
-    parse_float,
-    parse_int,
-    calc_fatality_ratio,
-    calc_incidence_rate,
-)
-from utils.strings import normalize_keyword
-from utils.requests import request_headers
+from utils.html import parse_document, extract_table
+from utils.requests import get_client
+from utils.artifacts import save_artifact, load_artifact
+from utils.sinks import get_sinks
+from utils.archive import archive_frames
 
 from conf.constants import (
     DATA_SCH_BASE_LINK,
+    SCH_PAGE_SIZE,
+    SCH_WORKERS,
     COLUMN_MAPPINGS
 )
 
+KEYS = ["school", "region", "dueTo"]
+TABLE_XPATH = '//table[contains(concat(" ", @class, " "), " kv-grid-table ")]'
+SUMMARY_XPATH = '//div[contains(concat(" ", @class, " "), " summary ")]//b'
+
+
 class SCHStrategy(object):
     """
     SCHStrategy
@@ -28,21 +34,45 @@ class SCHStrategy(object):
         self.name = name if name != None else type(self).__name__
         self.config = config[0] if config != None else {}
         self.dataframe = None
+        self.collection = "gr_school_closures"
         self.docs = []
+        self.fingerprint = None
+        self.unchanged = False
 
     def save_dataframe(self):
-        self.dataframe.to_csv("{}{}-{}.csv".format(
-            self.config.get("output"), 
-            datetime.now().strftime("%Y-%m-%d"),
-            self.name, 
-        ), index=False)
+        save_artifact(
+            self.dataframe,
+            self.config.get("output"),
+            self.name,
+            __file__,
+            self.fingerprint,
+        )
+        if self.config.get("archive"):
+            archive_frames([self.dataframe], self.config.get("output"), self.name, KEYS)
+
+    def from_cache(self):
+        self.dataframe, self.fingerprint = load_artifact(
+            self.config.get("output"), self.name, __file__
+        )
+        if self.dataframe is None:
+            raise Warning("[SCH] No cached artifact for {}".format(self.name))
+        return self
     
-    def as_docs(self):
+    def release(self):
+        """
+        Drop the frame and documents once they are stored
+        """
+        self.dataframe = None
         self.docs = []
-        for doc in self.dataframe.to_dict("records"):
+
+    def as_docs(self, dataframe):
+        docs = []
+        for doc in dataframe.to_dict("records"):
+            # a closure listed again has no expired_at
+            doc = {k: v for k, v in doc.items() if v is not None and v == v}
             doc = self.geo_loc(doc)
-            self.docs.append(doc)
-        return self.docs
+            docs.append(doc)
+        return docs
     
     def geo_loc(self, doc):
         lat = float(doc.pop('lat', 0.0))
@@ -52,7 +82,63 @@ class SCHStrategy(object):
         return doc
     
     def migrate(self):
-        pass
+        for sink in get_sinks(self.config, self.name):
+            start = time.time()
+            if self.config.get("drop"):
+                deleted, inserted = sink.replace(
+                    self.collection, [self.dataframe], self.as_docs, {"source": "sch"}, on="dueTo"
+                )
+                logging.debug(
+                    "[SCH] Migration Completed, {} deleted, {} inserted in {} on {} in {}s".format(
+                        deleted,
+                        inserted,
+                        self.collection,
+                        sink,
+                        round(time.time() - start, 2),
+                    )
+                )
+                continue
+
+            # the stored closures, listed or not, keyed like the scraped ones
+            stored = sink.read(
+                self.collection, {"source": "sch"}, ["dueTo", "last_updated_at", "expired_at"]
+            )
+            for column in KEYS + ["expired"]:
+                if column not in stored.columns:
+                    stored[column] = None
+            stored["dueTo"] = pd.to_datetime(stored["dueTo"])
+            stored["expired"] = stored["expired"].fillna(False).astype(bool)
+            scraped = pd.MultiIndex.from_frame(self.dataframe[KEYS])
+            known = pd.MultiIndex.from_frame(stored[KEYS])
+            listed = known.isin(scraped)
+
+            # closures dropped from the list end now, the rest are left untouched
+            new = self.dataframe[~scraped.isin(known)]
+            ended = stored[~listed & ~stored["expired"]].assign(
+                expired=True, expired_at=pd.to_datetime(datetime.today())
+            )
+            relisted = stored[listed & stored["expired"]].assign(expired=False, expired_at=pd.NaT)
+            logging.debug(
+                "[SCH] Migrate Documents {} new, {} no longer listed, {} listed again to {}".format(
+                    len(new), len(ended), len(relisted), sink
+                )
+            )
+            inserted, modified = sink.upsert(
+                self.collection,
+                [pd.concat([new, ended, relisted], ignore_index=True)],
+                self.as_docs,
+                KEYS,
+                on="dueTo",
+            )
+            logging.debug(
+                "[SCH] Migration Completed, {} inserted, {} modified in {} on {} in {}s".format(
+                    inserted,
+                    modified,
+                    self.collection,
+                    sink,
+                    round(time.time() - start, 2),
+                )
+            )
     
     def clean(self):
         pass
@@ -62,50 +148,57 @@ class SCHStrategy(object):
     
     def scrape_document(self, url):
         logging.debug("[SCH] Scraping url {}".format(url))
-        page = requests.get(url, headers=request_headers())
-        return BeautifulSoup(page.content, "html.parser")
-    
+        page = get_client(self.config).get(url)
+        return parse_document(page.content)
+
+    def scrape_page(self, page):
+        document = self.scrape_document(DATA_SCH_BASE_LINK + "?page=" + str(page))
+        return extract_table(document, TABLE_XPATH)[1]
+
     def get(self):
         logging.debug("[SCH] Getting Data")
-        
-        size = 100
-        page = 1
-        pages = 1
+
+        size = SCH_PAGE_SIZE
         # get page
-        soup = self.scrape_document(DATA_SCH_BASE_LINK)
-        # get total length
-        length = soup.find("div", attrs={"class": "summary"}).find_all("b")[-1].get_text()
-        pages = int(length) / size
-        
-        logging.debug("[SCH] Paging {} {} {} {}".format(length, size, page, pages))
-        
-        # get table
-        table = soup.find("table", attrs={"class": "kv-grid-table"})
-
-        # get headers
-        headers = [normalize_keyword(header.text) for header in table.find_all("th")]
-
-        # iter rows
-        rows = []
-        for row in table.find_all("tr"):
-            rows.append([normalize_keyword(val.text) for val in row.find_all("td")])
-            
-        #  loop through pages
-        while page < pages:
-            page += 1
-            soup = self.scrape_document(DATA_SCH_BASE_LINK + "?page=" + str(page))
-            # get table
-            table = soup.find("table", attrs={"class": "kv-grid-table"})
-
-            # iter rows
-            for row in table.find_all("tr"):
-                rows.append([normalize_keyword(val.text) for val in row.find_all("td")])
+        document = self.scrape_document(DATA_SCH_BASE_LINK)
+        # get total length, the summary formats it with thousands separators
+        length = document.xpath(SUMMARY_XPATH)[-1].text_content()
+        length = int(re.sub(r"\D", "", length))
+        pages = int(math.ceil(length / float(size)))
+
+        logging.debug("[SCH] Paging {} {} {}".format(length, size, pages))
+
+        # get table columns
+        headers, columns = extract_table(document, TABLE_XPATH)
+
+        # the other pages are fetched and parsed concurrently, lxml parses
+        # without holding the GIL, results come back in page order
+        with ThreadPoolExecutor(max_workers=SCH_WORKERS) as executor:
+            for values in executor.map(self.scrape_page, range(2, pages + 1)):
+                # append the page columns
+                for column, page_values in zip(columns, values):
+                    column.extend(page_values)
 
         # create the dataframe
-        df = pd.DataFrame(rows, columns=headers)
+        df = pd.DataFrame({i: column for i, column in enumerate(columns)})
+        df.columns = headers
         # rename columns
         df = df.rename(columns=COLUMN_MAPPINGS)
-        df = df[df["school"].str.strip().astype(bool)]
+        for column in ["school", "region", "address", "notes"]:
+            if column in df.columns:
+                df[column] = df[column].str.strip()
+        df = df[df["school"].astype(bool)]
+        # the ttl index expires closures from their due date
+        df["dueTo"] = pd.to_datetime(df["dueTo"], dayfirst=True, errors="coerce")
+        if df["dueTo"].isna().any():
+            logging.warning(
+                "[SCH] {} closures without a due date skipped".format(df["dueTo"].isna().sum())
+            )
+            df = df[df["dueTo"].notna()]
+        df = df.drop_duplicates(subset=KEYS).reset_index(drop=True)
+        df["expired"] = False
+        df["source"] = "sch"
+        df["last_updated_at"] = pd.to_datetime(datetime.today())
         
         logging.debug("[SCH] Data Cleaned & Merged, Building...")
         logging.debug("[SCH] Shape {}".format(df.shape))
@@ -1,25 +1,29 @@
 import logging
-import requests
 import time
 
 import pandas as pd
 import numpy as np
 
 from datetime import datetime
-from bs4 import BeautifulSoup
-from pymongo import ReplaceOne
+
+from utils.artifacts import save_artifact, load_artifact
+from utils.sinks import get_sinks
+from utils.archive import archive_frames
 
 from utils.numerical import (
-    parse_float,
-    parse_int,
-    calc_fatality_ratio,
-    calc_incidence_rate,
+    parse_numeric_series,
+    fatality_ratio,
+    incidence_rate,
 )
-from utils.strings import normalize_keyword
-from utils.requests import request_headers
+from utils.html import parse_document, read_table
+from utils.requests import get_client
+from utils.reference import load_reference
 
 from conf.constants import FIX_CORDS, EXCLUDE_ROWS, COLUMN_MAPPINGS, DATA_WOM_BASE_LINK
 
+# a row per key, the upserts and the archive match rows on it
+KEYS = ["date", "country", "source"]
+
 
 class WOMStrategy(object):
     """
@@ -32,16 +36,34 @@ class WOMStrategy(object):
         self.dataframe = None
         self.collection = "global"
         self.docs = []
+        self.fingerprint = None
+        self.unchanged = False
 
     def save_dataframe(self):
-        self.dataframe.to_csv(
-            "{}{}-{}.csv".format(
-                self.config.get("output"),
-                datetime.now().strftime("%Y-%m-%d"),
-                self.name,
-            ),
-            index=False,
+        save_artifact(
+            self.dataframe,
+            self.config.get("output"),
+            self.name,
+            __file__,
+            self.fingerprint,
+        )
+        if self.config.get("archive"):
+            archive_frames([self.dataframe], self.config.get("output"), self.name, KEYS)
+
+    def from_cache(self):
+        self.dataframe, self.fingerprint = load_artifact(
+            self.config.get("output"), self.name, __file__
         )
+        if self.dataframe is None:
+            raise Warning("[WOM] No cached artifact for {}".format(self.name))
+        return self
+
+    def release(self):
+        """
+        Drop the frame and documents once they are stored
+        """
+        self.dataframe = None
+        self.docs = []
 
     def as_docs(self, dataframe):
         docs = []
@@ -58,30 +80,25 @@ class WOMStrategy(object):
         return doc
     
     def migrate(self):
-        start = time.time()
-        self.docs = self.as_docs(self.dataframe)
-        coll = (
-            self.config.get("mongo_client")
-            .get_database("covid19")
-            .get_collection(self.collection)
-        )
-        logging.debug("[WOM] Migrate Documents {}".format(len(self.docs)))
-        deleted = coll.delete_many({"source": "worldometer"})
-        logging.debug(
-            "[WOM] Migration Drop Docs, {} deleted from {} in {}s".format(
-                deleted.deleted_count,
+        for sink in get_sinks(self.config, self.name):
+            start = time.time()
+            logging.debug("[WOM] Migrate Documents {} to {}".format(len(self.dataframe), sink))
+            deleted, inserted = sink.replace(
                 self.collection,
-                round(time.time() - start, 2),
+                [self.dataframe],
+                self.as_docs,
+                {"source": "worldometer"},
+                keys=KEYS,
             )
-        )
-        result = coll.insert_many(self.docs)
-        logging.debug(
-            "[WOM] Migration Completed, {} inserted in {} in {}s".format(
-                len(result.inserted_ids),
-                self.collection,
-                round(time.time() - start, 2),
+            logging.debug(
+                "[WOM] Migration Completed, {} deleted, {} inserted in {} on {} in {}s".format(
+                    deleted,
+                    inserted,
+                    self.collection,
+                    sink,
+                    round(time.time() - start, 2),
+                )
             )
-        )
             
     def clean(self):
         pass
@@ -91,24 +108,16 @@ class WOMStrategy(object):
 
     def scrape_document(self, url):
         logging.debug("[WOM] Scraping url {}".format(url))
-        page = requests.get(url, headers=request_headers())
-        return BeautifulSoup(page.content, "html.parser")
+        page = get_client(self.config).get(url)
+        return parse_document(page.content)
 
     def get(self):
         logging.debug("[WOM] Getting Data")
         # get latest world data from worldometer
         # url: https://www.worldometers.info/coronavirus/
-        soup = self.scrape_document(DATA_WOM_BASE_LINK)
-        # find table
-        table = soup.find("table", attrs={"id": "main_table_countries_today"})
-        # get headers
-        headers = [normalize_keyword(header.text) for header in table.find_all("th")]
-        # iter rows
-        rows = []
-        for row in table.find_all("tr"):
-            rows.append([normalize_keyword(val.text) for val in row.find_all("td")])
-        # create the dataframe
-        df = pd.DataFrame(rows[1:], columns=headers)
+        document = self.scrape_document(DATA_WOM_BASE_LINK)
+        # create the dataframe from the table columns
+        df = read_table(document, '//table[@id="main_table_countries_today"]')
         # rename columns
         df = df.rename(columns=COLUMN_MAPPINGS)
         logging.debug("[WOM] Data Loaded")
@@ -142,7 +151,7 @@ class WOMStrategy(object):
         # convert all string numbers to floats
         # for the moment we choose float instead of integers
         for column in colunms_to_float:
-            df[column] = df[column].apply(lambda x: parse_float(x))
+            df[column] = parse_numeric_series(df[column])
 
         df[
             [
@@ -217,12 +226,10 @@ class WOMStrategy(object):
             "int"
         )
 
-        df["case_fatality_ratio"] = df.apply(calc_fatality_ratio, axis=1)
-        df["incidence_rate"] = df.apply(calc_incidence_rate, axis=1)
+        df["case_fatality_ratio"] = fatality_ratio(df["cases"], df["deaths"])
+        df["incidence_rate"] = incidence_rate(df["cases"], df["population"])
 
-        fips = pd.read_csv(
-            "./data/countries-mapping-jhu-wom.csv"
-        ).to_dict("records")
+        fips = load_reference(self.config.get("tmp")).country_lookup()
         df[["population", "lat", "long", "country", "iso2", "iso3", "uid"]] = df.apply(
             lambda x: self._get_fips(x, fips), axis=1, result_type="expand"
         )
@@ -263,21 +270,9 @@ class WOMStrategy(object):
         return self
 
     def _get_fips(self, x, fips):
-        for y in fips:
-            if (
-                y["name_en"] == x["country"]
-                or y["country"] == x["country"]
-                or y["wom_map"] == x["country"]
-            ):
-                return (
-                    int(y["population"]),
-                    float(y["lat"]),
-                    float(y["long"]),
-                    y["name_en"],
-                    y["iso2"].upper(),
-                    y["iso3"].upper(),
-                    y["uid"],
-                )
+        y = fips.get(x["country"])
+        if y is not None:
+            return y
 
         logging.warning("[WOM] MISSING FIPS ({})".format(x["country"]))
         return x["country"], 0.0, 0.0, x["country"], "", "", 0
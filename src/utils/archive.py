@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+
+from conf.constants import ARCHIVE_IGNORE_COLUMNS, ARCHIVE_COMPRESSION
+
+"""
+Append-only history of a strategy frame. Every run stores only the rows that are
+new or changed since the previous run, and tombstones for the keys that are gone,
+as compressed segments listed in a manifest. Any earlier run can be rebuilt from them
+"""
+
+
+def archive_dir(output, name):
+    return "{}archive/{}/".format(output, name)
+
+
+def _manifest_path(root):
+    return root + "manifest.json"
+
+
+def _index_path(root):
+    return root + "index.parquet"
+
+
+def archive_runs(output, name):
+    """
+    The manifest entries, one per archived run in order
+    """
+    path = _manifest_path(archive_dir(output, name))
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path, value):
+    with open(path + ".tmp", "w") as f:
+        json.dump(value, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def _hashes(frame, columns):
+    """
+    Hash of the `columns` of each row, numeric widths and categoricals hash like plain values
+    """
+    values = frame[columns].copy()
+    for column in columns:
+        if values[column].dtype.name == "category":
+            values[column] = np.asarray(values[column])
+        if values[column].dtype.kind in "biuf":
+            values[column] = values[column].astype("float64")
+    return pd.util.hash_pandas_object(values, index=False).values
+
+
+def archive_frames(frames, output, name, keys, run=None, partial=False):
+    """
+    Append the rows of `frames` that changed since the last run,
+    returns the manifest entry or None when nothing changed.
+    A partial run holds only some of the keys, the others are kept instead of removed
+    """
+    root = archive_dir(output, name)
+    os.makedirs(root, exist_ok=True)
+    run = run or datetime.now()
+    stamp = run.strftime("%Y%m%dT%H%M%S")
+
+    manifest = archive_runs(output, name)
+    index = (
+        pd.read_parquet(_index_path(root))
+        if os.path.isfile(_index_path(root))
+        else pd.DataFrame(columns=keys + ["_key", "_hash"])
+    )
+    index = index.drop_duplicates(subset=["_key"], keep="last")
+    previous = pd.Series(index["_hash"].values, index=index["_key"].values)
+
+    files, rows, seen = [], 0, []
+    for frame in frames:
+        if len(frame) == 0:
+            continue
+        columns = sorted(c for c in frame.columns if c not in ARCHIVE_IGNORE_COLUMNS)
+        current = frame[keys].copy()
+        current["_key"] = _hashes(frame, keys)
+        current["_hash"] = _hashes(frame, columns)
+        seen.append(current)
+
+        changed = current["_key"].map(previous).values != current["_hash"].values
+        if changed.any():
+            path = "{}{}-{}.parquet".format(root, stamp, len(files))
+            frame[changed].to_parquet(path, index=False, compression=ARCHIVE_COMPRESSION)
+            files.append(os.path.basename(path))
+            rows += int(changed.sum())
+
+    seen = (
+        pd.concat(seen, ignore_index=True)
+        if len(seen) > 0
+        else pd.DataFrame(columns=keys + ["_key", "_hash"])
+    )
+    kept = ~np.isin(index["_key"].values, seen["_key"].values)
+    gone = index[kept & (not partial)]
+    if partial:
+        seen = pd.concat([index[kept], seen], ignore_index=True)
+    deleted = None
+    if len(gone) > 0:
+        deleted = "{}-deleted.parquet".format(stamp)
+        gone[keys].to_parquet(root + deleted, index=False, compression=ARCHIVE_COMPRESSION)
+
+    if len(files) == 0 and deleted is None:
+        logging.debug("[ARCHIVE] {} unchanged".format(name.upper()))
+        return None
+
+    # the manifest lists a run once its segments are written, the index follows,
+    # a run interrupted in between archives the same rows again
+    entry = {
+        "run": run.isoformat(),
+        "files": files,
+        "deleted": deleted,
+        "rows": rows,
+        "removed": len(gone),
+    }
+    _write_json(_manifest_path(root), manifest + [entry])
+    seen.to_parquet(_index_path(root) + ".tmp", index=False)
+    os.replace(_index_path(root) + ".tmp", _index_path(root))
+    logging.debug(
+        "[ARCHIVE] {} run {}, {} rows changed, {} removed".format(
+            name.upper(), entry["run"], rows, len(gone)
+        )
+    )
+    return entry
+
+
+def load_archive(output, name, keys, as_of=None):
+    """
+    The frame as it was after the last run at or before `as_of`, the latest when None
+    """
+    root = archive_dir(output, name)
+    as_of = pd.Timestamp(as_of) if as_of is not None else None
+    entries = [
+        e
+        for e in archive_runs(output, name)
+        if as_of is None or pd.Timestamp(e["run"]) <= as_of
+    ]
+    if len(entries) == 0:
+        return None
+
+    rows, tombstones = [], []
+    for seq, entry in enumerate(entries):
+        for f in entry["files"]:
+            rows.append(pd.read_parquet(root + f).assign(_seq=seq))
+        if entry["deleted"]:
+            tombstones.append(pd.read_parquet(root + entry["deleted"]).assign(_seq=seq))
+    if len(rows) == 0:
+        return None
+
+    # the newest version of every key, unless the key was removed after it
+    df = pd.concat(rows, ignore_index=True).drop_duplicates(subset=keys, keep="last")
+    if len(tombstones) > 0:
+        removed = (
+            pd.concat(tombstones, ignore_index=True)
+            .drop_duplicates(subset=keys, keep="last")
+            .rename(columns={"_seq": "_removed"})
+        )
+        df = df.merge(removed, how="left", on=keys)
+        df = df[~(df["_removed"] >= df["_seq"])].drop(columns=["_removed"])
+    return df.drop(columns=["_seq"]).reset_index(drop=True)
@@ -0,0 +1,82 @@
+import glob
+import hashlib
+import logging
+import os
+import shutil
+
+import pandas as pd
+
+
+def code_version(path):
+    """
+    Short hash of the module that builds the artifact
+    """
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:8]
+
+
+def artifact_path(output, name, version, fingerprint):
+    return "{}{}-{}-{}.parquet".format(output, name, version, fingerprint)
+
+
+def save_artifact(dataframe, output, name, module, fingerprint=None, keep=3):
+    """
+    Persist a stage frame keyed by input fingerprint and code version
+    """
+    if fingerprint is None:
+        fingerprint = hashlib.sha256(
+            pd.util.hash_pandas_object(dataframe, index=False).values.tobytes()
+        ).hexdigest()
+    path = artifact_path(output, name, code_version(module), fingerprint)
+    dataframe.to_parquet(path, index=False)
+    logging.debug("[{}] Artifact saved on {}".format(name.upper(), path))
+
+    # keep only the newest artifacts of each name
+    paths = sorted(
+        glob.glob("{}{}-*-*.parquet".format(output, name)),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for old in paths[keep:]:
+        os.remove(old)
+    return path
+
+
+def load_artifact(output, name, module):
+    """
+    Load the newest artifact built by the current code version
+    """
+    paths = sorted(
+        glob.glob(artifact_path(output, name, code_version(module), "*")),
+        key=os.path.getmtime,
+    )
+    if len(paths) == 0:
+        return None, None
+    path = paths[-1]
+    fingerprint = path[: -len(".parquet")].rsplit("-", 1)[-1]
+    logging.debug("[{}] Artifact loaded from {}".format(name.upper(), path))
+    return pd.read_parquet(path), fingerprint
+
+
+def partition_dir(output, name, module, fingerprint):
+    """
+    Directory for an artifact stored as one Parquet file per partition
+    """
+    path = artifact_path(output, name, code_version(module), fingerprint)
+    path = path[: -len(".parquet")] + "/"
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def load_partitions(output, name, module, fingerprint):
+    path = artifact_path(output, name, code_version(module), fingerprint)
+    return sorted(glob.glob(path[: -len(".parquet")] + "/*.parquet"))
+
+
+def prune_partitions(output, name, keep):
+    """
+    Remove every partition directory of `name` except `keep`
+    """
+    for path in glob.glob("{}{}-*-*/".format(output, name)):
+        if os.path.normpath(path) != os.path.normpath(keep):
+            shutil.rmtree(path, ignore_errors=True)
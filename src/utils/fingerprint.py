@@ -0,0 +1,89 @@
+import hashlib
+import logging
+
+from datetime import datetime
+
+from conf.constants import FINGERPRINTS_COLLECTION
+
+
+def file_digest(paths, digest=None):
+    """
+    Content hash of the given files, in order
+    """
+    digest = digest if digest is not None else hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _collection(config):
+    client = config.get("mongo_client")
+    if client is None:
+        return None
+    return client.get_database(config.get("db")).get_collection(
+        FINGERPRINTS_COLLECTION
+    )
+
+
+def load_fingerprint(config, source):
+    coll = _collection(config)
+    if coll is None:
+        return None
+    doc = coll.find_one({"source": source})
+    return doc["fingerprint"] if doc else None
+
+
+def save_fingerprint(config, source, fingerprint):
+    coll = _collection(config)
+    if coll is None or fingerprint is None:
+        return
+    coll.update_one(
+        {"source": source},
+        {
+            "$set": {
+                "fingerprint": fingerprint,
+                "last_updated_at": datetime.today(),
+            }
+        },
+        upsert=True,
+    )
+    logging.debug("[{}] Fingerprint {} saved".format(source.upper(), fingerprint))
+
+
+def is_unchanged(config, source, fingerprint):
+    """
+    True when the inputs match the last successful run and no rerun is forced
+    """
+    if config.get("force"):
+        return False
+    return fingerprint is not None and load_fingerprint(config, source) == fingerprint
+
+
+
+def load_manifest(config, source):
+    """
+    Per file digests stored by the last successful migration
+    """
+    coll = _collection(config)
+    if coll is None:
+        return {}
+    doc = coll.find_one({"source": source}) or {}
+    return {f["name"]: f["digest"] for f in doc.get("files", [])}
+
+
+def save_manifest(config, source, files):
+    coll = _collection(config)
+    if coll is None:
+        return
+    coll.update_one(
+        {"source": source},
+        {
+            "$set": {
+                "files": [{"name": n, "digest": d} for n, d in sorted(files.items())]
+            }
+        },
+        upsert=True,
+    )
+    logging.debug("[{}] Manifest of {} files saved".format(source.upper(), len(files)))
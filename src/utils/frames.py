@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+from conf.constants import CATEGORICAL_COLUMNS
+
+
+def carry_forward(df, target, columns, by="uid", on="date"):
+    """
+    Latest known values of `columns` per `by`, strictly before each target row's `on`
+    """
+    known = df.loc[df[columns].notna().any(axis=1), [by, on] + columns]
+    known = known.sort_values(on)
+
+    left = target[[by, on]].copy()
+    left["_row"] = np.arange(len(left))
+    left = left.sort_values(on)
+
+    # one sorted as-of join instead of a full scan per target row
+    merged = pd.merge_asof(left, known, on=on, by=by, allow_exact_matches=False)
+    merged = merged.sort_values("_row")
+    merged.index = target.index
+    return merged[columns]
+
+
+def diff_from_last(df, target, columns, by="uid", on="date"):
+    """
+    Increase of `columns` since the latest known values, NaN when not positive
+    """
+    last = carry_forward(df, target, columns, by=by, on=on)
+    diff = target[columns] - last
+    return diff.where(diff > 0)
+
+
+def _categories(values):
+    try:
+        return sorted(values)
+    except TypeError:
+        return list(values)
+
+
+def categorize(frames, columns):
+    """
+    Encode columns as categoricals sharing one dtype across frames,
+    so merges and groupbys between them keep the encoding
+    """
+    for column in columns:
+        present = [f for f in frames if column in f.columns]
+        if len(present) == 0:
+            continue
+        values = pd.unique(pd.concat([f[column] for f in present]).dropna())
+        dtype = pd.CategoricalDtype(_categories(values))
+        for f in present:
+            f[column] = f[column].astype(dtype)
+    return frames
+
+
+def downcast(df, columns=None):
+    """
+    Smallest integer width that holds every value of each integer column
+    """
+    columns = columns if columns is not None else df.select_dtypes("integer").columns
+    for column in columns:
+        df[column] = pd.to_numeric(df[column], downcast="integer")
+    return df
+
+
+def compact(df, categories=CATEGORICAL_COLUMNS):
+    """
+    Dtype policy for long frames, categoricals for location and source columns
+    and the smallest safe integer width for counts
+    """
+    categorize([df], [c for c in categories if c in df.columns and df[c].dtype != "category"])
+    return downcast(df)
+
+
+def by_precedence(frames, precedence, by="iso3", on="date"):
+    """
+    Each frame without the rows another source takes for the same `by` and `on`,
+    the source first in the `precedence` list of a `by` value wins
+    """
+    ranks = pd.DataFrame(
+        [
+            (value, source, rank)
+            for value, sources in precedence.items()
+            for rank, source in enumerate(sources)
+        ],
+        columns=[by, "source", "_rank"],
+    )
+    contested = []
+    for i, frame in enumerate(frames):
+        rows = np.flatnonzero(np.asarray(frame[by].isin(list(precedence))))
+        contested.append(
+            pd.DataFrame(
+                {
+                    by: np.asarray(frame[by], dtype=object)[rows],
+                    on: frame[on].values[rows],
+                    "source": np.asarray(frame["source"], dtype=object)[rows],
+                    "_frame": i,
+                    "_row": rows,
+                }
+            )
+        )
+    contested = pd.concat(contested, ignore_index=True).merge(
+        ranks, how="left", on=[by, "source"]
+    )
+    # unlisted sources rank after the listed ones
+    contested["_rank"] = contested["_rank"].fillna(len(ranks))
+    contested = contested.sort_values("_rank", kind="mergesort")
+    lost = contested[contested.duplicated(subset=[by, on], keep="first")]
+
+    resolved = []
+    for i, frame in enumerate(frames):
+        keep = np.ones(len(frame), dtype=bool)
+        keep[lost.loc[lost["_frame"] == i, "_row"].values] = False
+        resolved.append(frame if keep.all() else frame[keep])
+    return resolved
@@ -0,0 +1,55 @@
+import logging
+
+import pandas as pd
+
+from lxml import html
+
+from utils.strings import normalize_keywords
+
+
+def parse_document(content, encoding="utf-8"):
+    """
+    Parse an html page with lxml, pages without a charset would otherwise be read as latin-1
+    """
+    return html.fromstring(content, parser=html.HTMLParser(encoding=encoding))
+
+
+def extract_table(document, xpath):
+    """
+    Headers and column arrays of the first table matching `xpath`,
+    rows without cells, such as the header row, are skipped
+    """
+    tables = document.xpath(xpath)
+    if len(tables) == 0:
+        raise Exception("[HTML] No table matches {}".format(xpath))
+    table = tables[0]
+
+    headers = normalize_keywords([th.text_content() for th in table.iter("th")])
+    columns = [[] for _ in headers]
+    # plain element iteration, an xpath call per row costs more than the parse
+    for row in table.iter("tr"):
+        values = [td.text_content() for td in row.iterchildren("td")]
+        if len(values) == 0:
+            continue
+        values = values[: len(headers)]
+        values += [""] * (len(headers) - len(values))
+        for column, value in zip(columns, values):
+            column.append(value)
+
+    columns = [normalize_keywords(column) for column in columns]
+    logging.debug(
+        "[HTML] Table {} with {} columns, {} rows".format(
+            xpath, len(headers), len(columns[0]) if len(columns) > 0 else 0
+        )
+    )
+    return headers, columns
+
+
+def read_table(document, xpath):
+    """
+    The table matching `xpath` as a frame of strings, duplicate headers are kept
+    """
+    headers, columns = extract_table(document, xpath)
+    df = pd.DataFrame({i: column for i, column in enumerate(columns)})
+    df.columns = headers
+    return df
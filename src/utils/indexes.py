@@ -0,0 +1,256 @@
+import logging
+
+from datetime import timedelta
+
+RANGE_OPERATORS = ["$gt", "$gte", "$lt", "$lte"]
+
+# dashboard read workload, values starting with "$" are resolved by `resolve_params`
+DASHBOARD_QUERIES = [
+    {
+        "name": "global_latest_date",
+        "collection": "global",
+        "filter": {},
+        "sort": [("date", -1)],
+        "limit": 1,
+    },
+    {
+        "name": "global_latest_per_country",
+        "collection": "global",
+        "filter": {"date": "$global_latest"},
+        "sort": [("country", 1)],
+    },
+    {
+        "name": "global_country_series",
+        "collection": "global",
+        "filter": {"iso3": "$iso3"},
+        "sort": [("date", 1)],
+    },
+    {
+        "name": "global_source_series",
+        "collection": "global",
+        "filter": {"iso3": "$iso3", "source": "imedd"},
+        "sort": [("date", 1)],
+    },
+    {
+        "name": "greece_latest_per_region",
+        "collection": "greece",
+        "filter": {"date": "$greece_latest"},
+        "sort": [("region", 1)],
+    },
+    {
+        "name": "greece_region_series",
+        "collection": "greece",
+        "filter": {"region": "$region"},
+        "sort": [("date", 1)],
+    },
+    {
+        "name": "greece_state_series",
+        "collection": "greece",
+        "filter": {"state": "$state"},
+        "sort": [("date", 1)],
+    },
+    {
+        "name": "vaccines_latest_per_area",
+        "collection": "gr_vaccines",
+        "filter": {"date": "$vaccines_latest"},
+        "sort": [("area", 1)],
+    },
+    {
+        "name": "vaccines_area_range",
+        "collection": "gr_vaccines",
+        "filter": {
+            "area": "$area",
+            "date": {"$gte": "$vaccines_from", "$lte": "$vaccines_latest"},
+        },
+        "sort": [("date", 1)],
+    },
+]
+
+
+def resolve_params(db, iso3="GRC", days=30):
+    """
+    Pick representative parameter values from the loaded database
+    """
+    params = {"iso3": iso3}
+
+    latest = db.get_collection("global").find_one({}, sort=[("date", -1)])
+    params["global_latest"] = latest["date"] if latest else None
+
+    latest = db.get_collection("greece").find_one({}, sort=[("date", -1)])
+    params["greece_latest"] = latest["date"] if latest else None
+    params["region"] = latest["region"] if latest else None
+    params["state"] = latest["state"] if latest else None
+
+    latest = db.get_collection("gr_vaccines").find_one({}, sort=[("date", -1)])
+    params["vaccines_latest"] = latest["date"] if latest else None
+    params["vaccines_from"] = latest["date"] - timedelta(days=days) if latest else None
+    params["area"] = latest["area"] if latest else None
+
+    return params
+
+
+def _resolve(value, params):
+    if isinstance(value, dict):
+        return {k: _resolve(v, params) for k, v in value.items()}
+    if isinstance(value, str) and value.startswith("$") and value[1:] in params:
+        return params[value[1:]]
+    return value
+
+
+def explain_query(db, query, params):
+    cmd = {
+        "find": query["collection"],
+        "filter": _resolve(query["filter"], params),
+    }
+    if query.get("sort"):
+        cmd["sort"] = dict(query["sort"])
+    if query.get("limit"):
+        cmd["limit"] = query["limit"]
+    return db.command("explain", cmd, verbosity="executionStats")
+
+
+def plan_stages(plan):
+    """
+    Flatten every stage of an explain plan tree
+    """
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan)
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+def ideal_index(query):
+    """
+    Equality fields first, then sort fields, then range fields (ESR rule)
+    """
+    keys = []
+    ranges = []
+    for field, value in query["filter"].items():
+        if isinstance(value, dict) and any(op in value for op in RANGE_OPERATORS):
+            ranges.append((field, 1))
+        else:
+            keys.append((field, 1))
+    for field, direction in query.get("sort", []):
+        if field not in [k for k, _ in keys]:
+            # a single-field index can be walked both ways, normalize to ascending
+            keys.append((field, 1 if len(keys) == 0 else direction))
+    for field, direction in ranges:
+        if field not in [k for k, _ in keys]:
+            keys.append((field, direction))
+    return keys
+
+
+def _is_prefix(keys, other):
+    return len(keys) <= len(other) and list(other[: len(keys)]) == list(keys)
+
+
+def minimal_index_set(indexes):
+    """
+    Drop every index that is a prefix of another one
+    """
+    unique = []
+    for keys in indexes:
+        if keys not in unique:
+            unique.append(keys)
+    return [
+        keys
+        for keys in unique
+        if not any(other != keys and _is_prefix(keys, other) for other in unique)
+    ]
+
+
+def analyze(db, queries=DASHBOARD_QUERIES, params=None):
+    """
+    Run every catalogue query through explain("executionStats") and build an index report
+    """
+    params = params if params is not None else resolve_params(db)
+    results = []
+    used = {}
+    for query in queries:
+        explain = explain_query(db, query, params)
+        stats = explain.get("executionStats", {})
+        stages = plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        names = [s["indexName"] for s in stages if s.get("indexName")]
+        used.setdefault(query["collection"], set()).update(names)
+        result = {
+            "name": query["name"],
+            "collection": query["collection"],
+            "collscan": any(s["stage"] == "COLLSCAN" for s in stages),
+            "in_memory_sort": any(s["stage"] == "SORT" for s in stages),
+            "indexes": names,
+            "millis": stats.get("executionTimeMillis", 0),
+            "keys_examined": stats.get("totalKeysExamined", 0),
+            "docs_examined": stats.get("totalDocsExamined", 0),
+            "returned": stats.get("nReturned", 0),
+            "ideal": ideal_index(query),
+        }
+        results.append(result)
+        logging.debug("[ADVISOR] {}".format(result))
+
+    suggestions = {}
+    for collection in set(q["collection"] for q in queries):
+        ideal = minimal_index_set(
+            [r["ideal"] for r in results if r["collection"] == collection]
+        )
+        coll = db.get_collection(collection)
+        existing = {
+            name: [(k, d if isinstance(d, str) else int(d)) for k, d in info["key"]]
+            for name, info in coll.index_information().items()
+        }
+        accesses = {
+            stat["name"]: stat["accesses"]["ops"]
+            for stat in coll.aggregate([{"$indexStats": {}}])
+        }
+        suggestions[collection] = {
+            "add": [
+                keys
+                for keys in ideal
+                if not any(_is_prefix(keys, other) for other in existing.values())
+            ],
+            "drop": [
+                name
+                for name, keys in existing.items()
+                if name != "_id_"
+                and name not in used.get(collection, set())
+                and not any(_is_prefix(keys, other) for other in ideal)
+            ],
+            "accesses": accesses,
+        }
+
+    return results, suggestions
+
+
+def report(results, suggestions):
+    for r in results:
+        flags = []
+        if r["collscan"]:
+            flags.append("COLLSCAN")
+        if r["in_memory_sort"]:
+            flags.append("SORT")
+        logging.info(
+            "[ADVISOR] {} on {}: {}ms, {} keys / {} docs examined, {} returned, indexes {} {}".format(
+                r["name"],
+                r["collection"],
+                r["millis"],
+                r["keys_examined"],
+                r["docs_examined"],
+                r["returned"],
+                r["indexes"] or "-",
+                " ".join(flags),
+            )
+        )
+    for collection, s in sorted(suggestions.items()):
+        for keys in s["add"]:
+            logging.info("[ADVISOR] {} add index {}".format(collection, keys))
+        for name in s["drop"]:
+            logging.info(
+                "[ADVISOR] {} drop index {} ({} ops since restart)".format(
+                    collection, name, s["accesses"].get(name, 0)
+                )
+            )
@@ -0,0 +1,115 @@
+import logging
+import resource
+import time
+
+from contextlib import contextmanager
+
+from conf.constants import MEMORY_DOC_FIELD_BYTES, MEMORY_MIN_CHUNK
+
+
+def _status(key):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(key + ":"):
+                return int(line.split()[1]) / 1024
+    raise OSError(key)
+
+
+def rss():
+    """
+    Current resident set size in MB
+    """
+    try:
+        return _status("VmRSS")
+    except (IOError, OSError):
+        return peak_rss()
+
+
+def peak_rss():
+    """
+    Peak resident set size in MB, since the last `reset_peak`
+    """
+    try:
+        return _status("VmHWM")
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except (IOError, OSError):
+        pass
+
+
+def iter_chunks(dataframe, size=None):
+    """
+    The whole frame, or consecutive slices of `size` rows
+    """
+    if dataframe is None or len(dataframe) == 0:
+        return
+    if size is None:
+        yield dataframe
+        return
+    for start in range(0, len(dataframe), size):
+        yield dataframe.iloc[start : start + size]
+
+
+def chunk_size(config, dataframe):
+    budget = config.get("memory")
+    return None if budget is None else budget.chunk_size(dataframe)
+
+
+class MemoryBudget(object):
+    """
+    Per stage RSS tracking against an optional budget in MB
+    """
+
+    def __init__(self, budget=0):
+        self.budget = budget
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        before = rss()
+        reset_peak()
+        try:
+            yield
+        finally:
+            after = rss()
+            peak = peak_rss()
+            self.stages.append(
+                {"stage": name, "rss": after, "peak": peak, "delta": after - before}
+            )
+            logging.info(
+                "[MEMORY] {} rss {:.0f}MB ({:+.0f}MB), peak {:.0f}MB in {}s".format(
+                    name, after, after - before, peak, round(time.time() - start, 2)
+                )
+            )
+            if self.budget and peak > self.budget:
+                logging.warning(
+                    "[MEMORY] {} peak {:.0f}MB over budget {}MB".format(
+                        name, peak, self.budget
+                    )
+                )
+
+    def chunk_size(self, dataframe):
+        """
+        None when the documents of the whole frame fit in the budget,
+        otherwise the number of rows per chunk that do
+        """
+        if not self.budget or dataframe is None:
+            return None
+        per_doc = max(len(dataframe.columns), 1) * MEMORY_DOC_FIELD_BYTES
+        free = max(self.budget - rss(), 0) * 1024 * 1024
+        if len(dataframe) * per_doc <= free:
+            return None
+        size = max(MEMORY_MIN_CHUNK, int(free / per_doc))
+        logging.debug(
+            "[MEMORY] {:.0f}MB free, building documents in chunks of {}".format(
+                free / 1024 / 1024, size
+            )
+        )
+        return size
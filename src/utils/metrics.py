@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+from datetime import timedelta
+
+from utils.numerical import incidence_rate
+
+from conf.constants import METRICS_AVERAGE_DAYS, METRICS_INCIDENCE_DAYS, METRICS_GROWTH_DAYS
+
+# days of history the windows of a single row read
+WINDOW_DAYS = max(METRICS_AVERAGE_DAYS, METRICS_INCIDENCE_DAYS, 2 * METRICS_GROWTH_DAYS)
+
+
+def metric_columns(columns):
+    """
+    Names of the metrics `rolling_metrics` derives from each daily column
+    """
+    return [
+        name.format(column)
+        for column in columns
+        for name in ["{}_7d_avg", "{}_14d_per_100k", "{}_wow_growth"]
+    ]
+
+
+def _window_sums(keys, starts, days, firsts, sums, window):
+    """
+    Sum over the `window` days ending on each sorted row, NaN until the group has that many days
+    """
+    left = np.maximum(np.searchsorted(keys, keys - (window - 1), side="left"), starts)
+    total = sums - np.where(left > 0, sums[left - 1], 0.0)
+    return np.where(days - firsts >= window - 1, total, np.nan)
+
+
+def rolling_metrics(df, columns, by="uid", on="date", population="population", since=None):
+    """
+    7-day average, 14-day rate per 100k and week over week growth (%) of the daily `columns`
+    per `by`, negative corrections count as zero in the windows.
+    With `since` only the rows from that date get metrics, the earlier ones feed their windows
+    """
+    names = metric_columns(columns)
+    index = df.index
+    # the first day of each group, windows starting before it are incomplete
+    begins = df.groupby(by, sort=False)[on].transform("min")
+    if since is not None:
+        context = (df[on] >= since - timedelta(days=WINDOW_DAYS - 1)).values
+        df, begins = df[context], begins[context]
+    if len(df) == 0:
+        return pd.DataFrame(columns=names, index=index, dtype="float")
+
+    # rows sorted per group and day, windows are ranges of one cumulative sum
+    codes = pd.factorize(df[by])[0].astype("int64")
+    origin = begins.min()
+    days = ((df[on] - origin) // pd.Timedelta(days=1)).values.astype("int64")
+    firsts = ((begins - origin) // pd.Timedelta(days=1)).values.astype("int64")
+    order = np.lexsort((days, codes))
+    codes, days, firsts = codes[order], days[order], firsts[order]
+    keys = codes * (days.max() + WINDOW_DAYS + 1) + days
+    first = np.r_[True, codes[1:] != codes[:-1]]
+    starts = np.maximum.accumulate(np.where(first, np.arange(len(codes)), 0))
+    people = pd.Series(df[population].values[order].astype("float"))
+
+    metrics = {}
+    for column in columns:
+        values = np.clip(np.nan_to_num(df[column].values[order].astype("float")), 0, None)
+        sums = np.cumsum(values)
+        week = _window_sums(keys, starts, days, firsts, sums, METRICS_AVERAGE_DAYS)
+        fortnight = _window_sums(keys, starts, days, firsts, sums, METRICS_INCIDENCE_DAYS)
+        last = _window_sums(keys, starts, days, firsts, sums, METRICS_GROWTH_DAYS)
+        previous = _window_sums(keys, starts, days, firsts, sums, 2 * METRICS_GROWTH_DAYS) - last
+        with np.errstate(divide="ignore", invalid="ignore"):
+            growth = np.where(previous > 0, (last / previous - 1) * 100, np.nan)
+        for name, metric in zip(
+            metric_columns([column]),
+            [
+                week / METRICS_AVERAGE_DAYS,
+                incidence_rate(pd.Series(fortnight), people).where(~np.isnan(fortnight)).values,
+                growth,
+            ],
+        ):
+            metrics[name] = np.empty(len(metric))
+            metrics[name][order] = np.round(metric, 4)
+
+    metrics = pd.DataFrame(metrics, index=df.index, columns=names)
+    if since is not None:
+        metrics[(df[on] < since).values] = np.nan
+    return metrics.reindex(index)
@@ -1,4 +1,5 @@
 import numpy as np
+import pandas as pd
 
 def parse_float(s):
     if s is None or len(s) == 0 or s == "N/A":
@@ -14,6 +15,22 @@ def parse_int(s):
     return int(s)
 
 
+def parse_numeric_series(s):
+    """
+    `parse_float` on a whole column, each distinct value is parsed once
+    """
+    codes, uniques = pd.factorize(s)
+    values = pd.Series(uniques, dtype="object").str.replace(",", "", regex=False)
+    values = values.where(~values.isin(["", "N/A"]))
+    values = pd.to_numeric(values).astype("float").values
+    # missing cells are coded -1, which picks the trailing NaN
+    return pd.Series(
+        np.append(values, np.nan)[codes],
+        index=s.index,
+        name=s.name,
+    )
+
+
 # Case-Fatality Ratio (%): Case-Fatality Ratio (%) = Number recorded deaths / Number cases.
 def calc_fatality_ratio(x):
     return 0 if x["cases"] == 0 else round(float((x["deaths"] / x["cases"]) * 100), 4)
@@ -29,4 +46,23 @@ def calc_incidence_rate(x):
 
 # Available ICUs
 def calc_available_icus(x):
-    return 0 if x["icu_occupancy"] == 0 else int((x["critical"] * 100) / x["icu_occupancy"])
\ No newline at end of file
+    return 0 if x["icu_occupancy"] == 0 else int((x["critical"] * 100) / x["icu_occupancy"])
+
+
+# Vectorized versions of the above, on whole columns
+def fatality_ratio(cases, deaths):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.round((deaths / cases) * 100, 4)
+    return ratio.where(cases != 0, 0)
+
+
+def incidence_rate(cases, population):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.round((cases * 100000.0) / population, 4)
+    return rate.where(population != 0, 0)
+
+
+def available_icus(critical, icu_occupancy):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        icus = np.trunc((critical * 100) / icu_occupancy)
+    return icus.where(icu_occupancy != 0, 0).astype("int")
@@ -0,0 +1,106 @@
+import logging
+import threading
+
+from queue import Queue
+
+from conf.constants import MIGRATE_BATCH_SIZE, MIGRATE_QUEUE_DEPTH
+from utils.memory import chunk_size
+
+
+class BatchWriteError(Exception):
+    """
+    A batch the writer failed to store, with the batch itself and where it was going
+    """
+
+    def __init__(self, batch, context, cause):
+        self.batch = batch
+        self.context = context
+        self.cause = cause
+        details = getattr(cause, "details", None)
+        if isinstance(details, dict) and details.get("writeErrors"):
+            cause = "{} write errors, first: {}".format(
+                len(details["writeErrors"]), details["writeErrors"][0].get("errmsg")
+            )
+        super(BatchWriteError, self).__init__(
+            "[PIPELINE] {} batch {} ({} items) to {} failed, {}".format(
+                str(context.get("source")).upper(),
+                context.get("batch"),
+                len(batch),
+                context.get("collection"),
+                cause,
+            )
+        )
+
+
+def batch_size(config, dataframe):
+    """
+    Rows per batch, smaller when the memory budget asks for it
+    """
+    size = chunk_size(config, dataframe)
+    return MIGRATE_BATCH_SIZE if size is None else min(size, MIGRATE_BATCH_SIZE)
+
+
+def insert_writer(coll):
+    def write(docs):
+        result = coll.insert_many(docs)
+        return len(result.inserted_ids), 0
+
+    return write
+
+
+def bulk_writer(coll):
+    def write(reqs):
+        result = coll.bulk_write(reqs)
+        return result.inserted_count + result.upserted_count, result.modified_count
+
+    return write
+
+
+def pipelined(batches, write, context, depth=MIGRATE_QUEUE_DEPTH):
+    """
+    Build batches in this thread while a writer thread stores the previous ones,
+    at most `depth` built batches wait for the writer.
+    Returns the (inserted, modified) totals, raises BatchWriteError on the first failed batch
+    """
+    queue = Queue(maxsize=depth)
+    state = {"inserted": 0, "modified": 0, "batches": 0, "error": None}
+
+    def writer():
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            index, batch = item
+            # after a failure keep draining so the producer never blocks
+            if state["error"] is not None:
+                continue
+            try:
+                inserted, modified = write(batch)
+                state["inserted"] += inserted
+                state["modified"] += modified
+                state["batches"] += 1
+            except Exception as e:
+                state["error"] = BatchWriteError(batch, dict(context, batch=index), e)
+
+    thread = threading.Thread(
+        target=writer, name="writer-{}".format(context.get("source")), daemon=True
+    )
+    thread.start()
+    try:
+        for index, batch in enumerate(batches):
+            if state["error"] is not None:
+                break
+            if len(batch) > 0:
+                queue.put((index, batch))
+    finally:
+        queue.put(None)
+        thread.join()
+
+    if state["error"] is not None:
+        raise state["error"]
+    logging.debug(
+        "[PIPELINE] {} {} batches written to {}".format(
+            str(context.get("source")).upper(), state["batches"], context.get("collection")
+        )
+    )
+    return state["inserted"], state["modified"]
@@ -0,0 +1,182 @@
+import os
+import hashlib
+import logging
+import pickle
+
+from types import MappingProxyType
+
+import pandas as pd
+
+from conf.constants import (
+    COLUMN_MAPPINGS,
+    REFERENCE_COUNTRIES_PATH,
+    REFERENCE_REGIONS_PATH,
+)
+
+COUNTRIES_COLUMNS = {
+    "name_en": "object",
+    "iso2": "object",
+    "iso3": "object",
+    "uid": "int64",
+    "population": "int64",
+    "lat": "float64",
+    "long": "float64",
+    "country": "object",
+    "wom_map": "object",
+}
+REGIONS_COLUMNS = {
+    "uid": "object",
+    "geo_unit": "object",
+    "state": "object",
+    "region_el": "object",
+    "region": "object",
+    "lat": "float64",
+    "long": "float64",
+    "population": "int64",
+    "map_value": "object",
+    "areaid": "float64",
+}
+
+_REFERENCE = None
+
+
+def _validate(name, df, columns):
+    missing = [c for c in columns if c not in df.columns]
+    if len(missing) > 0:
+        raise Exception("Reference data {} is missing columns {}".format(name, missing))
+    if df["lat"].abs().max() > 90 or df["long"].abs().max() > 180:
+        raise Exception("Reference data {} has coordinates out of range".format(name))
+    uids = df["uid"].dropna()
+    if uids.duplicated().any():
+        logging.warning(
+            "[REFERENCE] {} duplicate uids {}".format(
+                name, uids[uids.duplicated()].tolist()
+            )
+        )
+    return df.astype({c: t for c, t in columns.items() if t != "object"})
+
+
+def _parse(countries_path, regions_path):
+    countries = pd.read_csv(countries_path).rename(columns=COLUMN_MAPPINGS)
+    countries = _validate("countries", countries, COUNTRIES_COLUMNS)
+    regions = pd.read_csv(regions_path).rename(columns=COLUMN_MAPPINGS)
+    regions["population"] = regions["population"].fillna(0)
+    regions = _validate("regions", regions, REGIONS_COLUMNS)
+    return countries, regions
+
+
+class ReferenceData(object):
+    """
+    Mapping tables parsed once, with read-only lookups
+    """
+
+    def __init__(self, countries, regions, digest, mtimes=None):
+        self._countries = countries
+        self._regions = regions
+        self.digest = digest
+        self.mtimes = mtimes
+
+        # JHU and WOM match a country by any of its names, the first row wins
+        lookup = {}
+        for y in reversed(countries.to_dict("records")):
+            value = (
+                int(y["population"]),
+                float(y["lat"]),
+                float(y["long"]),
+                y["name_en"],
+                y["iso2"].upper(),
+                y["iso3"].upper(),
+                y["uid"],
+            )
+            for key in ["name_en", "country", "wom_map"]:
+                if pd.notna(y[key]):
+                    lookup[y[key]] = value
+        self._country_lookup = MappingProxyType(lookup)
+
+        # iMEdD matches a region by its greek name or its mapped value
+        lookup = {}
+        for y in reversed(regions[regions["uid"].notna()].to_dict("records")):
+            value = (
+                y["uid"],
+                y["geo_unit"],
+                y["state"],
+                y["region"],
+                y["population"],
+                y["lat"],
+                y["long"],
+            )
+            for key in ["region_el", "map_value"]:
+                if pd.notna(y[key]):
+                    lookup[y[key]] = value
+        self._region_lookup = MappingProxyType(lookup)
+
+        # GovGR matches a region by its area id
+        lookup = {}
+        for y in reversed(regions[regions["areaid"].notna()].to_dict("records")):
+            lookup[int(y["areaid"])] = (
+                y["geo_unit"],
+                y["state"],
+                y["region"],
+                y["population"],
+                y["lat"],
+                y["long"],
+            )
+        self._area_lookup = MappingProxyType(lookup)
+
+    def countries(self):
+        return self._countries.copy()
+
+    def regions(self):
+        return self._regions.copy()
+
+    def country(self, name):
+        return self._countries.loc[self._countries["country"] == name].to_dict("records")
+
+    def country_lookup(self):
+        return self._country_lookup
+
+    def region_lookup(self):
+        return self._region_lookup
+
+    def area_lookup(self):
+        return self._area_lookup
+
+
+def load_reference(cache=None, countries_path=REFERENCE_COUNTRIES_PATH, regions_path=REFERENCE_REGIONS_PATH):
+    """
+    Process wide reference data, rebuilt only when the mapping CSVs change
+    """
+    global _REFERENCE
+
+    paths = [countries_path, regions_path]
+    mtimes = [os.path.getmtime(path) for path in paths]
+    if _REFERENCE is not None and _REFERENCE.mtimes == mtimes:
+        return _REFERENCE
+
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    digest = digest.hexdigest()
+    if _REFERENCE is not None and _REFERENCE.digest == digest:
+        _REFERENCE.mtimes = mtimes
+        return _REFERENCE
+
+    compiled = None if cache is None else os.path.join(cache, "reference.pickle")
+    if compiled is not None and os.path.isfile(compiled):
+        with open(compiled, "rb") as f:
+            countries, regions, compiled_digest = pickle.load(f)
+        if compiled_digest == digest:
+            logging.debug("[REFERENCE] Loaded compiled {}".format(compiled))
+            _REFERENCE = ReferenceData(countries, regions, digest, mtimes)
+            return _REFERENCE
+
+    countries, regions = _parse(countries_path, regions_path)
+    if compiled is not None:
+        os.makedirs(cache, exist_ok=True)
+        with open(compiled, "wb") as f:
+            pickle.dump((countries, regions, digest), f, protocol=pickle.HIGHEST_PROTOCOL)
+        logging.debug("[REFERENCE] Compiled {}".format(compiled))
+
+    _REFERENCE = ReferenceData(countries, regions, digest, mtimes)
+    return _REFERENCE
@@ -1,5 +1,230 @@
+import os
+import json
+import hashlib
+import logging
+import random
+import threading
+import time
+
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from conf.constants import (
+    HTTP_TIMEOUT,
+    HTTP_RETRIES,
+    HTTP_BACKOFF,
+    HTTP_RETRY_STATUSES,
+    HTTP_POOL_SIZE,
+    HTTP_RATE_LIMITS,
+)
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
 def request_headers():
     return {
         "User-Agent": "Mozilla/5.0 (compatible; CVCIOBot/1.1; +https://cvcio.org/)",
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
     }
+
+
+class HttpClient(object):
+    """
+    Pooled session per host, retries with exponential backoff, per host rate limits
+    and an on-disk cache revalidated with ETag / Last-Modified
+    """
+
+    def __init__(self, cache=None, rate_limits=HTTP_RATE_LIMITS):
+        self.cache = cache
+        self.rate_limits = rate_limits
+        self.sessions = {}
+        self.locks = {}
+        self.next_slot = {}
+        self.lock = threading.Lock()
+        self.hosts = {}
+        if self.cache is not None:
+            os.makedirs(self.cache, exist_ok=True)
+
+    def session(self, host):
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(request_headers())
+                self.sessions[host] = session
+                self.locks[host] = threading.Lock()
+                self.next_slot[host] = 0.0
+            return self.sessions[host]
+
+    def _wait(self, host):
+        rate = self.rate_limits.get(host)
+        if not rate:
+            return
+        with self.locks[host]:
+            now = time.time()
+            slot = max(now, self.next_slot[host])
+            self.next_slot[host] = slot + 1.0 / rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _key(self, url, headers):
+        # responses may differ per token, never store the token itself
+        key = url + "\n" + headers.get("Authorization", "")
+        return os.path.join(self.cache, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def _load(self, key):
+        if not os.path.isfile(key + ".json") or not os.path.isfile(key + ".body"):
+            return None
+        with open(key + ".json") as f:
+            meta = json.load(f)
+        with open(key + ".body", "rb") as f:
+            meta["content"] = f.read()
+        return meta
+
+    def _store(self, key, response):
+        meta = {
+            "url": response.url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "headers": {
+                k: v
+                for k, v in response.headers.items()
+                if k.lower() in ["content-type", "etag", "last-modified"]
+            },
+        }
+        with open(key + ".body", "wb") as f:
+            f.write(response.content)
+        with open(key + ".json", "w") as f:
+            json.dump(meta, f)
+
+    def _cached(self, url, entry):
+        response = requests.models.Response()
+        response.url = url
+        response.status_code = 200
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = entry["content"]
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+
+    def get(self, url, headers=None, cache=True):
+        host = urlparse(url).netloc
+        session = self.session(host)
+        headers = dict(headers or {})
+
+        key = self._key(url, headers) if self.cache is not None and cache else None
+        entry = self._load(key) if key is not None else None
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        start = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            self._wait(host)
+            try:
+                response = session.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+                if response.status_code not in HTTP_RETRY_STATUSES or attempt > HTTP_RETRIES:
+                    break
+                retry_after = response.headers.get("Retry-After", "")
+                delay = float(retry_after) if retry_after.isdigit() else None
+                reason = response.status_code
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt > HTTP_RETRIES:
+                    raise
+                delay = None
+                reason = e.__class__.__name__
+            if delay is None:
+                delay = HTTP_BACKOFF * (2 ** (attempt - 1)) * (1 + random.random())
+            logging.debug(
+                "[HTTP] GET {} {}, retry {} in {:.2f}s".format(url, reason, attempt, delay)
+            )
+            time.sleep(delay)
+
+        if response.status_code == 304 and entry is None:
+            # nothing cached to serve the 304 with, asked once more unconditionally
+            headers = {
+                k: v
+                for k, v in headers.items()
+                if k.lower() not in ["if-none-match", "if-modified-since"]
+            }
+            attempt += 1
+            self._wait(host)
+            response = session.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+            if response.status_code == 304:
+                raise Exception(
+                    "[HTTP] GET {} 304 Not Modified without a cached response".format(url)
+                )
+
+        from_cache = response.status_code == 304 and entry is not None
+        timing = {
+            "url": url,
+            "host": host,
+            "status": response.status_code,
+            "attempts": attempt,
+            "seconds": round(time.time() - start, 3),
+            "bytes": len(response.content),
+            "from_cache": from_cache,
+        }
+        with self.lock:
+            h = self.hosts.setdefault(
+                host,
+                {"requests": 0, "from_cache": 0, "bytes": 0, "seconds": 0.0, "max_seconds": 0.0},
+            )
+            h["requests"] += 1
+            h["from_cache"] += int(from_cache)
+            h["bytes"] += timing["bytes"]
+            h["seconds"] = round(h["seconds"] + timing["seconds"], 3)
+            h["max_seconds"] = max(h["max_seconds"], timing["seconds"])
+        logging.debug(
+            "[HTTP] GET {} {} in {}s, {} bytes, {} attempts{}".format(
+                url,
+                timing["status"],
+                timing["seconds"],
+                timing["bytes"],
+                attempt,
+                ", served from cache" if from_cache else "",
+            )
+        )
+
+        if from_cache:
+            response = self._cached(url, entry)
+        else:
+            response.raise_for_status()
+            if key is not None and (
+                response.headers.get("ETag") or response.headers.get("Last-Modified")
+            ):
+                self._store(key, response)
+        response.from_cache = from_cache
+        response.timing = timing
+        return response
+
+    def summary(self, reset=False):
+        """
+        Requests, cache hits, bytes, total and slowest seconds per host,
+        since the client was created or last reset
+        """
+        with self.lock:
+            hosts = {host: dict(h) for host, h in self.hosts.items()}
+            if reset:
+                self.hosts = {}
+        return hosts
+
+
+def get_client(config):
+    """
+    Process wide client per cache directory, so connections are reused across strategies
+    """
+    cache = config.get("tmp") + "http/" if config.get("tmp") else None
+    with _CLIENTS_LOCK:
+        if cache not in _CLIENTS:
+            _CLIENTS[cache] = HttpClient(cache)
+        return _CLIENTS[cache]
@@ -0,0 +1,138 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from conf.constants import REVISIONS_COLLECTION, REVISIONS_IGNORE_COLUMNS
+
+
+def _collection(config):
+    return (
+        config.get("mongo_client")
+        .get_database(config.get("db"))
+        .get_collection(REVISIONS_COLLECTION)
+    )
+
+
+def _value(value):
+    """
+    Plain python values for the delta documents
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    return None if value is None or value != value else value
+
+
+def stored_docs(coll, docs, keys, match=None):
+    """
+    The stored documents sharing the keys of `docs`, as a frame.
+    Each key is narrowed by its values, the exact pairs are matched in `find_revisions`
+    """
+    frame = pd.DataFrame(docs)
+    query = dict(match or {})
+    for key in keys:
+        if key in frame.columns and key not in query:
+            values = [_value(v) for v in frame[key].drop_duplicates().tolist()]
+            query[key] = {"$in": values}
+    return pd.DataFrame(list(coll.find(query, {"_id": 0, "loc": 0})))
+
+
+def find_revisions(stored, docs, keys, collection, run):
+    """
+    A delta document per changed numeric field of the documents already stored,
+    and one without a field marking each document stored for the first time
+    """
+    if len(docs) == 0:
+        return []
+    current = pd.DataFrame(docs)
+    for key in keys:
+        for frame in (stored, current):
+            if key not in frame.columns:
+                frame[key] = None
+
+    seen = pd.MultiIndex.from_frame(current[keys].astype("object")).isin(
+        pd.MultiIndex.from_frame(stored[keys].astype("object"))
+    )
+    revisions = [
+        dict(
+            {k: _value(v) for k, v in zip(keys, row)},
+            collection=collection,
+            field=None,
+            created=True,
+            run=run,
+        )
+        for row in current.loc[~seen, keys].itertuples(index=False)
+    ]
+    if len(stored) == 0:
+        return revisions
+
+    fields = [
+        c
+        for c in current.columns
+        if c in stored.columns
+        and c not in keys
+        and c not in REVISIONS_IGNORE_COLUMNS
+        and pd.api.types.is_numeric_dtype(current[c])
+        and pd.api.types.is_numeric_dtype(stored[c])
+    ]
+    merged = stored[keys + fields].merge(
+        current[keys + fields], on=keys, suffixes=("_old", "_new")
+    )
+
+    for field in fields:
+        old, new = merged[field + "_old"], merged[field + "_new"]
+        changed = (old != new) & ~(old.isna() & new.isna())
+        for row in merged.loc[changed, keys + [field + "_old", field + "_new"]].itertuples(
+            index=False
+        ):
+            revision = {k: _value(v) for k, v in zip(keys, row[: len(keys)])}
+            revision.update(
+                {
+                    "collection": collection,
+                    "field": field,
+                    "old": _value(row[-2]),
+                    "new": _value(row[-1]),
+                    "run": run,
+                }
+            )
+            revisions.append(revision)
+    return revisions
+
+
+def save_revisions(config, revisions):
+    if len(revisions) == 0:
+        return 0
+    _collection(config).insert_many(revisions)
+    logging.debug(
+        "[REVISIONS] {} changed values of {} recorded".format(
+            len(revisions), revisions[0]["collection"]
+        )
+    )
+    return len(revisions)
+
+
+def value_as_of(config, collection, key, field, run):
+    """
+    The value of `field` for the document with `key` as stored after `run`,
+    None when the document was first stored later, otherwise the first
+    revision made later holds it or it is the current value
+    """
+    revisions = _collection(config)
+    created = revisions.find_one(
+        dict(key, collection=collection, field=None, created=True), sort=[("run", -1)]
+    )
+    if created is not None and created["run"] > run:
+        return None
+    revision = revisions.find_one(
+        dict(key, collection=collection, field=field, run={"$gt": run}),
+        sort=[("run", 1)],
+    )
+    if revision is not None:
+        return revision["old"]
+    doc = (
+        config.get("mongo_client")
+        .get_database(config.get("db"))
+        .get_collection(collection)
+        .find_one(key, {field: 1})
+    )
+    return doc.get(field) if doc is not None else None
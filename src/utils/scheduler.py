@@ -0,0 +1,116 @@
+import json
+import logging
+import random
+import threading
+import time
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_schedule(value):
+    """
+    Parse a "source=seconds,source=seconds" schedule
+    """
+    schedule = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        source, seconds = item.split("=")
+        schedule[source.strip()] = int(seconds)
+    return schedule
+
+
+class Scheduler(object):
+    """
+    Run a job per source on a fixed interval, one run at a time
+    """
+
+    def __init__(self, schedule, job, jitter=0):
+        self.schedule = schedule
+        self.job = job
+        self.jitter = jitter
+        self.lock = threading.Lock()
+        self.started_at = datetime.now()
+        self.status = {
+            source: {
+                "interval": interval,
+                "running": False,
+                "runs": 0,
+                "failures": 0,
+                "last_run": None,
+                "last_duration": None,
+                "last_error": None,
+                "next_run": time.time(),
+            }
+            for source, interval in schedule.items()
+        }
+
+    def run_once(self, source):
+        # runs never overlap, a slow source delays the next due one
+        with self.lock:
+            status = self.status[source]
+            status["running"] = True
+            start = time.time()
+            logging.info("[SCHEDULER] Running {}".format(source.upper()))
+            try:
+                self.job(source)
+                status["last_error"] = None
+            except Exception as e:
+                status["failures"] += 1
+                status["last_error"] = str(e)
+                logging.error("[SCHEDULER] {} failed, {}".format(source.upper(), e))
+            finally:
+                status["running"] = False
+                status["runs"] += 1
+                status["last_run"] = start
+                status["last_duration"] = round(time.time() - start, 2)
+                status["next_run"] = (
+                    start + status["interval"] + random.uniform(0, self.jitter)
+                )
+                logging.info(
+                    "[SCHEDULER] {} finished in {}s, next run at {}".format(
+                        source.upper(),
+                        status["last_duration"],
+                        datetime.fromtimestamp(status["next_run"]).strftime("%Y-%m-%d %T"),
+                    )
+                )
+
+    def run_forever(self):
+        while True:
+            source = min(self.status, key=lambda s: self.status[s]["next_run"])
+            delay = self.status[source]["next_run"] - time.time()
+            if delay > 0:
+                time.sleep(min(delay, 60))
+                continue
+            self.run_once(source)
+
+    def snapshot(self):
+        sources = {}
+        for source, status in self.status.items():
+            sources[source] = dict(status)
+            for key in ["last_run", "next_run"]:
+                if status[key] is not None:
+                    sources[source][key] = datetime.fromtimestamp(status[key]).isoformat()
+        return {"started_at": self.started_at.isoformat(), "sources": sources}
+
+    def serve_status(self, port, host="127.0.0.1"):
+        scheduler = self
+
+        class StatusHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(scheduler.snapshot()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("[SCHEDULER] Status " + format % args)
+
+        server = ThreadingHTTPServer((host, port), StatusHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        logging.info("[SCHEDULER] Status endpoint on http://{}:{}/".format(host, port))
+        return server
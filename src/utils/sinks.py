@@ -0,0 +1,470 @@
+import glob
+import os
+import sqlite3
+import uuid
+
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+from pymongo import ReplaceOne
+
+from conf.constants import ALLOWED_SINKS, MIGRATE_BATCH_SIZE
+from utils.memory import iter_chunks
+from utils.pipeline import pipelined, batch_size, insert_writer, bulk_writer
+from utils.revisions import stored_docs, find_revisions, save_revisions
+
+
+def _mask(dataframe, match):
+    """
+    Rows of `dataframe` matching every `match` value, lists match any of their values
+    """
+    mask = pd.Series(True, index=dataframe.index)
+    for column, value in (match or {}).items():
+        if column not in dataframe.columns:
+            return mask & False
+        if isinstance(value, (list, tuple, set)):
+            mask &= dataframe[column].isin(list(value))
+        else:
+            mask &= dataframe[column] == value
+    return mask
+
+
+def _month(path):
+    return os.sep.join(path.split(os.sep)[-2:])
+
+
+def _keyed(dataframe, others, keys):
+    """
+    Rows of `dataframe` whose `keys` appear in `others`
+    """
+    if any(k not in dataframe.columns for k in keys):
+        return pd.Series(False, index=dataframe.index)
+    index = pd.MultiIndex.from_frame(dataframe[keys].astype("object"))
+    return pd.Series(
+        index.isin(pd.MultiIndex.from_frame(others[keys].astype("object"))),
+        index=dataframe.index,
+    )
+
+
+class MongoSink(object):
+    """
+    Documents in the mongodb collections, shaped by the strategy `as_docs`
+    """
+
+    def __init__(self, config, name):
+        self.config = config
+        self.name = name
+        self.run = datetime.today()
+
+    def __str__(self):
+        return "mongo"
+
+    def collection(self, collection):
+        return (
+            self.config.get("mongo_client")
+            .get_database(self.config.get("db"))
+            .get_collection(collection)
+        )
+
+    def _filter(self, match):
+        return {
+            column: {"$in": list(value)} if isinstance(value, (list, tuple, set)) else value
+            for column, value in (match or {}).items()
+        }
+
+    def _revise(self, coll, collection, docs, keys, match):
+        """
+        Record the values the documents change before they are written
+        """
+        if self.config.get("revisions") and keys is not None and len(docs) > 0:
+            stored = stored_docs(coll, docs, keys, match)
+            save_revisions(
+                self.config, find_revisions(stored, docs, keys, collection, self.run)
+            )
+        return docs
+
+    def replace(self, collection, frames, as_docs, match, on="date", keys=None):
+        """
+        Delete the documents matching `match` and insert the frames, returns (deleted, inserted)
+        """
+        coll = self.collection(collection)
+        match = self._filter(match)
+        if self.config.get("revisions") and keys is not None:
+            return self._replace_revised(coll, collection, frames, as_docs, keys, match)
+        deleted = coll.delete_many(match).deleted_count
+        inserted, _ = pipelined(
+            (
+                as_docs(chunk)
+                for frame in frames
+                for chunk in iter_chunks(frame, batch_size(self.config, frame))
+            ),
+            insert_writer(coll),
+            {"source": self.name, "collection": collection},
+        )
+        return deleted, inserted
+
+    def _replace_revised(self, coll, collection, frames, as_docs, keys, match):
+        """
+        Replace compared with the stored documents chunk by chunk, the documents are
+        upserted on their `keys` and the matching ones left unwritten are deleted after
+        """
+        written = []
+
+        def requests():
+            for frame in frames:
+                for chunk in iter_chunks(frame, batch_size(self.config, frame)):
+                    docs = self._revise(coll, collection, as_docs(chunk), keys, match)
+                    written.append(pd.DataFrame([{k: doc.get(k) for k in keys} for doc in docs]))
+                    yield [
+                        ReplaceOne(dict(match, **{k: doc.get(k) for k in keys}), doc, upsert=True)
+                        for doc in docs
+                    ]
+
+        upserted, _ = pipelined(
+            requests(), bulk_writer(coll), {"source": self.name, "collection": collection}
+        )
+        inserted = sum(len(w) for w in written)
+
+        # only the keys are read back to find the documents the frames no longer hold
+        stored = pd.DataFrame(list(coll.find(match, {k: 1 for k in keys})))
+        # the documents written over count as deleted, like the plain replace
+        deleted = inserted - upserted
+        if len(stored) > 0:
+            written = pd.concat(written, ignore_index=True) if written else pd.DataFrame()
+            for key in keys:
+                for frame in (stored, written):
+                    if key not in frame.columns:
+                        frame[key] = None
+            stale = stored.loc[~_keyed(stored, written, keys), "_id"].tolist()
+            for start in range(0, len(stale), MIGRATE_BATCH_SIZE):
+                deleted += coll.delete_many(
+                    {"_id": {"$in": stale[start : start + MIGRATE_BATCH_SIZE]}}
+                ).deleted_count
+        return deleted, inserted
+
+    def upsert(self, collection, frames, as_docs, keys, match=None, on="date"):
+        """
+        Replace the documents with the same `keys`, returns (inserted, modified)
+        """
+        coll = self.collection(collection)
+        match = self._filter(match)
+        return pipelined(
+            (
+                [
+                    ReplaceOne(
+                        dict({k: doc.get(k) for k in keys}, **match), doc, upsert=True
+                    )
+                    for doc in self._revise(coll, collection, as_docs(chunk), keys, match)
+                ]
+                for frame in frames
+                for chunk in iter_chunks(frame, batch_size(self.config, frame))
+            ),
+            bulk_writer(coll),
+            {"source": self.name, "collection": collection},
+        )
+
+    def read(self, collection, match, dates=None):
+        return pd.DataFrame(
+            list(self.collection(collection).find(self._filter(match), {"_id": 0}))
+        )
+
+
+class ParquetSink(object):
+    """
+    Parquet files partitioned as collection/source=/year=/month=, readable as a hive dataset
+    """
+
+    def __init__(self, config, name, path=None):
+        self.config = config
+        self.name = name
+        self.path = path or config.get("output") + "parquet/"
+
+    def __str__(self):
+        return "parquet:{}".format(self.path)
+
+    def _partition(self, collection, source, year=None, month=None):
+        path = os.path.join(self.path, collection, "source={}".format(source))
+        if year is not None:
+            path = os.path.join(path, "year={}".format(year), "month={:02d}".format(month))
+        return path
+
+    def _partitions(self, collection, sources=None):
+        root = os.path.join(self.path, collection)
+        if sources is None:
+            sources = ["*"]
+        paths = set()
+        for source in sources:
+            for path in glob.glob(
+                os.path.join(root, "source={}".format(source), "**", "*.parquet"),
+                recursive=True,
+            ):
+                paths.add(os.path.dirname(path))
+        return sorted(paths)
+
+    def _split(self, collection, frame, on):
+        """
+        The frame per partition directory, the source is kept in the path only
+        """
+        if on in frame.columns:
+            # undated rows go to year=0/month=00
+            dates = pd.to_datetime(frame[on])
+            by = [
+                frame["source"],
+                dates.dt.year.fillna(0).astype("int"),
+                dates.dt.month.fillna(0).astype("int"),
+            ]
+        else:
+            by = [frame["source"]]
+        for values, part in frame.groupby(by, sort=False, observed=True):
+            values = values if isinstance(values, tuple) else (values,)
+            yield self._partition(collection, *values), part.drop(columns=["source"])
+
+    def _load(self, path):
+        parts = sorted(glob.glob(os.path.join(path, "*.parquet")))
+        if len(parts) == 0:
+            return None, parts
+        frame = pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True)
+        source = path.split("source=", 1)[1].split(os.sep, 1)[0]
+        return frame.assign(source=source), parts
+
+    def _write(self, path, frame, replaces=()):
+        """
+        Write a part file, the replaced ones are removed once it is in place
+        """
+        os.makedirs(path, exist_ok=True)
+        target = os.path.join(path, "part-{}.parquet".format(uuid.uuid4().hex))
+        if len(frame) > 0:
+            frame.drop(columns=["source"], errors="ignore").to_parquet(
+                target + ".tmp", index=False
+            )
+            os.replace(target + ".tmp", target)
+        for part in replaces:
+            os.remove(part)
+
+    def replace(self, collection, frames, as_docs, match, on="date", keys=None):
+        sources = match.get("source") if match else None
+        sources = [sources] if isinstance(sources, str) else sources
+        deleted = 0
+        for path in self._partitions(collection, sources):
+            existing, parts = self._load(path)
+            mask = _mask(existing, match)
+            if mask.any():
+                deleted += int(mask.sum())
+                self._write(path, existing[~mask], parts)
+
+        inserted = 0
+        written = set()
+        for frame in frames:
+            for path, part in self._split(collection, frame, on):
+                self._write(path, part)
+                written.add(path)
+            inserted += len(frame)
+
+        # streamed frames leave one file each, one file per partition scans faster
+        for path in written:
+            existing, parts = self._load(path)
+            if len(parts) > 1:
+                self._write(path, existing, parts)
+        return deleted, inserted
+
+    def upsert(self, collection, frames, as_docs, keys, match=None, on="date"):
+        inserted, modified = 0, 0
+        for frame in frames:
+            if len(frame) == 0:
+                continue
+            incoming = dict(self._split(collection, frame, on))
+            # stored rows of other sources are replaced too when the match allows them
+            sources = (match or {}).get("source")
+            if sources is None and "source" in keys:
+                sources = frame["source"].unique().tolist()
+            sources = [sources] if isinstance(sources, str) else sources
+            months = set(_month(path) for path in incoming)
+            candidates = [
+                path
+                for path in self._partitions(collection, sources)
+                if on not in frame.columns or _month(path) in months
+            ]
+            replaced = []
+            for path in sorted(set(candidates) | set(incoming)):
+                existing, parts = self._load(path)
+                part = incoming.get(path)
+                if existing is not None:
+                    mask = _keyed(existing, frame, keys) & _mask(existing, match)
+                    if part is None and not mask.any():
+                        continue
+                    replaced.append(existing.loc[mask, keys])
+                    part = pd.concat([existing[~mask], part], ignore_index=True)
+                self._write(path, part, parts)
+            if len(replaced) > 0:
+                modified += int(_keyed(frame, pd.concat(replaced), keys).sum())
+            inserted += len(frame)
+        return inserted - modified, modified
+
+    def read(self, collection, match, dates=None):
+        sources = match.get("source") if match else None
+        sources = [sources] if isinstance(sources, str) else sources
+        frames = []
+        for path in self._partitions(collection, sources):
+            existing, _ = self._load(path)
+            frames.append(existing[_mask(existing, match)])
+        if len(frames) == 0:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+
+class SQLiteSink(object):
+    """
+    One table per collection in an embedded SQLite file
+    """
+
+    def __init__(self, config, name, path=None):
+        self.config = config
+        self.name = name
+        self.path = path or config.get("output") + "covid19.sqlite"
+
+    def __str__(self):
+        return "sqlite:{}".format(self.path)
+
+    @contextmanager
+    def transaction(self):
+        """
+        A connection committed on success and closed either way
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _quote(self, name):
+        return '"{}"'.format(name.replace('"', '""'))
+
+    def _columns(self, conn, table):
+        return [
+            row[1]
+            for row in conn.execute("PRAGMA table_info({})".format(self._quote(table)))
+        ]
+
+    def _prepare(self, conn, table, frame):
+        """
+        Create the table or add the columns it is missing
+        """
+        columns = self._columns(conn, table)
+        if len(columns) == 0:
+            frame.head(0).to_sql(table, conn, index=False)
+            return
+        for column in frame.columns:
+            if column not in columns:
+                conn.execute(
+                    "ALTER TABLE {} ADD COLUMN {}".format(
+                        self._quote(table), self._quote(column)
+                    )
+                )
+
+    def _param(self, value):
+        return value.to_pydatetime() if isinstance(value, pd.Timestamp) else value
+
+    def _where(self, match, alias):
+        clauses, params = [], []
+        for column, value in (match or {}).items():
+            name = "{}.{}".format(alias, self._quote(column))
+            if isinstance(value, (list, tuple, set)):
+                value = list(value)
+                clauses.append("{} IN ({})".format(name, ", ".join("?" * len(value))))
+                params.extend(self._param(v) for v in value)
+            else:
+                clauses.append("{} IS ?".format(name))
+                params.append(self._param(value))
+        return " AND ".join(clauses) or "1", params
+
+    def _insert(self, conn, table, frame):
+        frame.to_sql(table, conn, index=False, if_exists="append", chunksize=batch_size(self.config, frame))
+
+    def replace(self, collection, frames, as_docs, match, on="date", keys=None):
+        deleted, inserted = 0, 0
+        with self.transaction() as conn:
+            columns = self._columns(conn, collection)
+            if len(columns) > 0 and all(c in columns for c in (match or {})):
+                where, params = self._where(match, self._quote(collection))
+                deleted = conn.execute(
+                    "DELETE FROM {} WHERE {}".format(self._quote(collection), where), params
+                ).rowcount
+            for frame in frames:
+                self._prepare(conn, collection, frame)
+                self._insert(conn, collection, frame)
+                inserted += len(frame)
+        return deleted, inserted
+
+    def upsert(self, collection, frames, as_docs, keys, match=None, on="date"):
+        inserted, modified = 0, 0
+        table = self._quote(collection)
+        staging = self._quote(collection + "__upsert")
+        with self.transaction() as conn:
+            for frame in frames:
+                if len(frame) == 0:
+                    continue
+                self._prepare(conn, collection, frame)
+                # the staged rows are stored the way the table stores them, keys compare as equals
+                frame.to_sql(collection + "__upsert", conn, index=False, if_exists="replace")
+                where, params = self._where(match, table)
+                keyed = " AND ".join(
+                    "{s}.{k} IS {t}.{k}".format(s=staging, t=table, k=self._quote(k))
+                    for k in keys
+                )
+                modified += conn.execute(
+                    "SELECT COUNT(*) FROM {s} WHERE EXISTS (SELECT 1 FROM {t} WHERE {where} AND {keys})".format(
+                        t=table, s=staging, where=where, keys=keyed
+                    ),
+                    params,
+                ).fetchone()[0]
+                conn.execute(
+                    "DELETE FROM {t} WHERE {where} AND EXISTS (SELECT 1 FROM {s} WHERE {keys})".format(
+                        t=table, s=staging, where=where, keys=keyed
+                    ),
+                    params,
+                )
+                columns = ", ".join(self._quote(c) for c in frame.columns)
+                conn.execute(
+                    "INSERT INTO {} ({c}) SELECT {c} FROM {}".format(table, staging, c=columns)
+                )
+                conn.execute("DROP TABLE {}".format(staging))
+                inserted += len(frame)
+        return inserted - modified, modified
+
+    def read(self, collection, match, dates=None):
+        with self.transaction() as conn:
+            if len(self._columns(conn, collection)) == 0:
+                return pd.DataFrame()
+            where, params = self._where(match, self._quote(collection))
+            return pd.read_sql(
+                "SELECT * FROM {} WHERE {}".format(self._quote(collection), where),
+                conn,
+                params=params,
+                parse_dates=dates,
+            )
+
+
+SINKS = {
+    "mongo": MongoSink,
+    "parquet": ParquetSink,
+    "sqlite": SQLiteSink,
+}
+
+
+def get_sinks(config, name):
+    """
+    The sinks a strategy writes through, from `--sink kind[:path]`, mongodb by default
+    """
+    sinks = []
+    for spec in config.get("sinks") or ["mongo"]:
+        kind, _, path = spec.partition(":")
+        if kind not in ALLOWED_SINKS:
+            raise Exception('Sorry, sink "{}" not allowed'.format(kind))
+        sinks.append(SINKS[kind](config, name, path) if path else SINKS[kind](config, name))
+    return sinks
@@ -1,5 +1,10 @@
 import re
 
+_TAGS = re.compile("<.*?>")
+_KEYWORD_CHARS = re.compile("[!@#$<>|]")
+_SPACES = re.compile(" +")
+
+
 def normalize_text(s):
     """
     Normalize input string
@@ -10,9 +15,9 @@ def normalize_text(s):
     # trim text
     text = s.strip()
     # remove html forgotten tags
-    text = re.sub(re.compile("<.*?>"), "", text)
+    text = _TAGS.sub("", text)
     # remove double space
-    text = re.sub(" +", " ", text)
+    text = _SPACES.sub(" ", text)
 
     return text
 
@@ -25,7 +30,22 @@ def normalize_keyword(s, strict=False):
         return ""
 
     text = "".join(s)
-    text = re.sub("[!@#$<>|]", "", text)
+    text = _KEYWORD_CHARS.sub("", text)
     text = normalize_text(text)
 
     return text
+
+
+def normalize_keywords(values):
+    """
+    `normalize_keyword` over a list of strings, each distinct value is normalized once
+    """
+    cache = {}
+    keywords = []
+    for s in values:
+        keyword = cache.get(s)
+        if keyword is None:
+            keyword = cache[s] = normalize_keyword(s)
+        keywords.append(keyword)
+    return keywords
+
@@ -0,0 +1,175 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from strategies.govgr import GovGRStrategy
+from utils.reference import load_reference
+
+# areas of the fixture, the last one has no fips
+AREAS = 6
+DAYS = 60
+
+
+def fixture_payload():
+    """
+    API rows of a few areas from the first published day, as data.gov.gr returns them
+    """
+    regions = pd.read_csv(os.path.join(ROOT, "data/region-mapping-imedd.csv"))
+    areas = (
+        regions.dropna(subset=["areaid"])[["areaid", "region_el"]]
+        .drop_duplicates("areaid")
+        .head(AREAS - 1)
+        .values.tolist()
+    ) + [[9999, "Nowhere"]]
+    rng = np.random.default_rng(3)
+    days = pd.date_range("2020-12-28", periods=DAYS)
+    rows = []
+    for areaid, area in areas:
+        persons = np.cumsum(rng.integers(0, 100, DAYS))
+        doses = [np.cumsum(rng.integers(0, n, DAYS)) for n in (60, 30, 10)]
+        for i, day in enumerate(days):
+            rows.append(
+                {
+                    "area": area,
+                    "areaid": int(areaid),
+                    "referencedate": day.strftime("%Y-%m-%dT00:00:00"),
+                    "totaldistinctpersons": int(persons[i]),
+                    "totalvaccinations": int(sum(d[i] for d in doses)),
+                    "daytotal": int(rng.integers(0, 50)),
+                    "daydiff": int(rng.integers(-5, 5)),
+                    "totaldose1": int(doses[0][i]),
+                    "totaldose2": int(doses[1][i]),
+                    "totaldose3": int(doses[2][i]),
+                    "dailydose1": int(rng.integers(0, 20)),
+                    "dailydose2": int(rng.integers(0, 20)),
+                    "dailydose3": int(rng.integers(0, 20)),
+                }
+            )
+    return rows
+
+
+def previous_transform(response, fips):
+    """
+    The row wise GovGR transform the vectorized one replaced, full history only
+    """
+    first = pd.to_datetime(datetime.strptime("2020-12-27", "%Y-%m-%d"))
+    totals = ["total_distinct_persons", "total_vaccinations", "total_dose_1", "total_dose_2", "total_dose_3"]
+    counts = [
+        "total_distinct_persons", "total_vaccinations", "day_total", "day_diff",
+        "total_dose_1", "total_dose_2", "total_dose_3",
+        "daily_dose_1", "daily_dose_2", "daily_dose_3",
+    ]
+
+    df = pd.DataFrame.from_dict(response, orient="columns")
+    df = df.rename(columns={
+        "totaldistinctpersons": "total_distinct_persons",
+        "totalvaccinations": "total_vaccinations",
+        "daytotal": "day_total",
+        "daydiff": "day_diff",
+        "totaldose1": "total_dose_1",
+        "totaldose2": "total_dose_2",
+        "totaldose3": "total_dose_3",
+        "dailydose1": "daily_dose_1",
+        "dailydose2": "daily_dose_2",
+        "dailydose3": "daily_dose_3",
+    })
+    df["date"] = pd.to_datetime(df["referencedate"])
+    df = df.sort_values(by="date").reset_index(drop=True)
+    df = df.drop(columns=["referencedate"])
+
+    first_day = df[df["date"] == first + timedelta(days=1)].reset_index(drop=True)
+    first_day.loc[:, "date"] = first
+    first_day["temp"] = first_day["total_distinct_persons"] - first_day["day_total"]
+    for column in ["total_distinct_persons", "total_vaccinations", "day_total", "day_diff", "total_dose_1", "daily_dose_1"]:
+        first_day.loc[:, column] = first_day["temp"]
+    for column in ["total_dose_2", "total_dose_3", "daily_dose_2", "daily_dose_3"]:
+        first_day.loc[:, column] = np.nan
+    first_day = first_day.drop(columns=["temp"])
+    df = pd.concat([df, first_day]).reset_index(drop=True)
+
+    df["uid"] = df["areaid"].apply(lambda x: "PE{}".format(x))
+
+    group = df.groupby(["date", "area", "areaid", "uid"])[counts].sum().reset_index()
+
+    temp = group.groupby(["uid", "date"])[totals]
+    temp = temp.sum().diff().reset_index()
+    mask = temp["uid"] != temp["uid"].shift(1)
+    for column in totals:
+        temp.loc[mask, column] = np.nan
+    temp.columns = ["uid", "date"] + ["new_" + c for c in totals]
+
+    group = pd.merge(group, temp, on=["uid", "date"])
+    group = group.fillna(0)
+    group[["new_" + c for c in totals]] = group[["new_" + c for c in totals]].astype("int")
+
+    df = group
+    synthetic = df["date"] == first
+    for column in ["new_total_distinct_persons", "new_total_vaccinations", "new_total_dose_1"]:
+        df.loc[synthetic, [column]] = df["day_total"]
+    for column in ["new_total_dose_2", "new_total_dose_3"]:
+        df.loc[synthetic, [column]] = np.nan
+    df = df.fillna(0)
+
+    columns = counts + ["new_total_dose_1", "new_total_dose_2", "new_total_dose_3"]
+    df[columns] = df[columns].astype("int")
+
+    def get_fips(x):
+        y = fips.get(x["areaid"])
+        return y if y is not None else ("", "", "", 0, 0.0, 0.0)
+
+    df[["geo_unit", "state", "region", "population", "lat", "long"]] = df.apply(
+        get_fips, axis=1, result_type="expand"
+    )
+    df["source"] = "govgr"
+    return df.sort_values(by="date").reset_index(drop=True)
+
+
+class GovGRTransformTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        os.chdir(ROOT)
+        self.tmp = tempfile.mkdtemp() + "/"
+        self.payload = fixture_payload()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def transform(self):
+        payload = self.payload
+        strategy = GovGRStrategy("govgr", [{"tmp": self.tmp, "output": self.tmp, "force": True}])
+
+        def get_recursive(date_start=None):
+            strategy.digest.update(repr(payload).encode("utf-8"))
+            return payload
+
+        strategy.get_recursive = get_recursive
+        return strategy.get().dataframe
+
+    def test_matches_previous_transform(self):
+        fips = load_reference(self.tmp).area_lookup()
+        expected = previous_transform(self.payload, fips)
+        got = self.transform()
+
+        self.assertEqual(len(got), AREAS * (DAYS + 1))
+        columns = list(expected.columns)
+        self.assertTrue(set(columns) <= set(got.columns))
+
+        def normalize(df):
+            return df[columns].sort_values(["date", "uid"]).reset_index(drop=True)
+
+        pd.testing.assert_frame_equal(normalize(got), normalize(expected), check_dtype=False)
+
+
+if __name__ == "__main__":
+    unittest.main()